@@ -21,6 +21,24 @@ window.dashExtensions = Object.assign({}, window.dashExtensions, {
                 }
             }
             return style;
+        },
+        function1: function(feature, context) {
+            // only show inhabited cells
+            if (!feature.properties.populated) {
+                return false;
+            }
+            // the cells to show, as a base64 bitmap of their ids
+            const visible = context.hideout.visible;
+            if (visible == null) {
+                return true;
+            }
+            // decode the bitmap once for every new hideout
+            if (context.hideout.bits === undefined) {
+                context.hideout.bits = Uint8Array.from(atob(visible), c => c.charCodeAt(0));
+            }
+            const bits = context.hideout.bits;
+            const fid = feature.properties.fid;
+            return (fid >> 3) < bits.length && (bits[fid >> 3] & (1 << (fid & 7))) !== 0;
         }
     }
 });
\ No newline at end of file
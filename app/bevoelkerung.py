@@ -8,6 +8,14 @@ import dash_leaflet as dl
 from dash import Dash, html, Output, Input, dcc
 from dash_extensions.javascript import arrow_function, assign
 import json
+from os.path import join
+
+from flask import Response, abort
+
+from features import FeatureIndex
+from registry import registry
+from tiles import fileVersion
+from vectortiles import MIMETYPE, VectorTiles
 
 # Stylesheet to control style
 external_stylesheets = ["https://codepen.io/chriddyp/pen/bWLwgP.css"]
@@ -17,7 +25,29 @@ external_scripts = [
 ]
 
 
-def main(local):
+def main(
+    local,
+    idMasks=True,
+    tileDirectory="tile-cache",
+    rasterTiles=False,
+    rasterDirectory="../data/landsat/resolution",
+):
+    """
+    Make the app.
+
+    @param local: If C{True}, serve the app from the root URL instead of
+        /casgis/.
+    @param idMasks: If C{True}, the browser loads the cells of the population
+        map once and the sliders only send a bitmap of the ids of the cells
+        to show. Else the sliders send the FeatureCollection of the cells to
+        show.
+    @param tileDirectory: The C{str} directory to cache map tiles in, or
+        C{None} to only cache them in memory.
+    @param rasterTiles: If C{True}, show the temperature map as image tiles
+        rendered from the rasters instead of a polygon per cell.
+    @param rasterDirectory: The C{str} directory with the scene cube and the
+        average temperature raster, for the image tiles.
+    """
     if local:
         dashApp = Dash(
             name=__name__,
@@ -206,49 +236,117 @@ def main(local):
     }"""
     )
 
-    # Load the population dataset
-    with open("assets/pop-data.json", "r") as f:
-        zh_population = json.load(f)
+    filter_handle = assign(
+        """function(feature, context){
+        // only show inhabited cells
+        if (!feature.properties.populated) {
+            return false;
+        }
+        // the cells to show, as a base64 bitmap of their ids
+        const visible = context.hideout.visible;
+        if (visible == null) {
+            return true;
+        }
+        // decode the bitmap once for every new hideout
+        if (context.hideout.bits === undefined) {
+            context.hideout.bits = Uint8Array.from(atob(visible), c => c.charCodeAt(0));
+        }
+        const bits = context.hideout.bits;
+        const fid = feature.properties.fid;
+        return (fid >> 3) < bits.length && (bits[fid >> 3] & (1 << (fid & 7))) !== 0;
+    }"""
+    )
 
-    # Load the temperature dataset
-    with open("assets/all-data.json", "r") as f:
-        temp_data = json.load(f)
+    # Register the datasets, which are loaded on first use, see registry.py.
+    # With ID masks, the server only needs the columns of the population
+    # index, which the gunicorn master loads and shares with the workers. The
+    # feature dicts are only loaded where they are used: for the
+    # FeatureCollections without ID masks, and for the vector tiles.
+    def load_temp_data():
+        """
+        Load the dataset.
+        """
+        with open("assets/all-data.json", "r") as f:
+            return json.load(f)
+
+    def populated(collection):
+        """
+        The population map shows the inhabited cells only, which share their
+        features with the temperature map.
+        """
+        return {
+            "type": "FeatureCollection",
+            "features": [
+                feature
+                for feature in collection["features"]
+                if feature["properties"]["populated"]
+            ],
+        }
+
+    def load_zh_population():
+        """
+        Select the cells of the population map.
+        """
+        return populated(registry.get("temp_data"))
+
+    def load_population_index():
+        """
+        Index the properties the population map is filtered by. With ID masks,
+        the features are parsed for the index only and dropped.
+        """
+        return FeatureIndex(
+            populated(load_temp_data()) if idMasks else registry.get("zh_population"),
+            columns=("n_total", "n_old", "perc_old", "average_temp"),
+            hotspotColumns=("average_temp_gis",),
+            idProperty="fid",
+            keepFeatures=not idMasks,
+        )
+
+    registry.register("temp_data", load_temp_data, preload=not idMasks)
+    registry.register("zh_population", load_zh_population, preload=not idMasks)
+    registry.register("population_index", load_population_index)
 
-    # Create geojson for the population dataset
     if local:
-        popURL = "/assets/pop-data.json"
+        allURL = "/assets/all-data.json"
     else:
-        popURL = "/casgis/assets/pop-data.json"
+        allURL = "/casgis/assets/all-data.json"
+
+    # How to style the cells of the population map
+    population_hideout = dict(
+        colorscale=colorscale,
+        classes=classes,
+        style={
+            "weight": 0,
+            "opacity": 1,
+            "color": "white",
+            "dashArray": "3",
+            "fillOpacity": 0.9,
+        },
+        colorProp="average_temp",
+        min=min(classes),
+        max=max(classes),
+    )
+
+    # Create geojson for the population dataset. With ID masks, the browser
+    # loads the same file as the temperature map once, and the
+    # update_geojson callback sets the cells to show in the hideout. Else it
+    # sets the data. The callback also runs when the page loads.
+    if idMasks:
+        source = dict(url=allURL, filter=filter_handle)
+    else:
+        source = {}
     geojson = dl.GeoJSON(
-        url=popURL,
+        **source,
         # How to style each polygon
         style=style_handle,
         zoomToBoundsOnClick=True,
         # Style applied on hover
         hoverStyle=arrow_function(dict(weight=1, color="#666", dashArray="")),
-        # How to style the cell
-        hideout=dict(
-            colorscale=colorscale,
-            classes=classes,
-            style={
-                "weight": 0,
-                "opacity": 1,
-                "color": "white",
-                "dashArray": "3",
-                "fillOpacity": 0.9,
-            },
-            colorProp="average_temp",
-            min=min(classes),
-            max=max(classes),
-        ),
+        hideout=population_hideout,
         id="geojson",
     )
 
     # Create geojson for the temperature dataset
-    if local:
-        allURL = "/assets/all-data.json"
-    else:
-        allURL = "/casgis/assets/all-data.json"
     geojson_2 = dl.GeoJSON(
         url=allURL,
         style=style_handle,
@@ -274,6 +372,47 @@ def main(local):
         id="geojson_2",
     )
 
+    # The bands of the temperature map, in the order of the image slider
+    image_bands = [
+        "average_temp",
+        "20220623",
+        "20220716",
+        "20220717",
+        "20220725",
+        "20220801",
+        "20220802",
+        "20220809",
+        "20220810",
+    ]
+
+    # Render the temperature map as image tiles at
+    # raster/<band>/<z>/<x>/<y>.png, coloured like the cells, directly from
+    # the scene cube and the average temperature raster.
+    if rasterTiles:
+        # rastertiles reads the rasters with giscode, which needs the
+        # repository root on the Python path, so only import it when needed.
+        from rastertiles import RasterTiles, readBands
+
+        def load_raster_tiles():
+            """
+            Load the rasters. The scenes are memory-mapped from the cube.
+            """
+            cube = join(rasterDirectory, "cube")
+            average = join(rasterDirectory, "average-resolution.TIF")
+            bands, grid = readBands(cube, average)
+            return RasterTiles(
+                bands,
+                grid.transform,
+                grid.crs,
+                colorscale,
+                (20, 55),
+                directory=tileDirectory
+                and join(tileDirectory, fileVersion(cube + ".npy", average), "raster"),
+            )
+
+        registry.register("raster_tiles", load_raster_tiles)
+        rasterURL = dashApp.config.requests_pathname_prefix + "raster/"
+
     # Create information control for the population dataset
     info = html.Div(
         children=get_info(),
@@ -341,9 +480,19 @@ def main(local):
                             dl.TileLayer(),
                             # Don't zoom when scrolling the page
                             dl.GestureHandling(),
-                            geojson_2,
+                        ]
+                        + (
+                            [
+                                dl.TileLayer(
+                                    url=rasterURL + "average_temp/{z}/{x}/{y}.png",
+                                    id="temperature-tiles",
+                                )
+                            ]
+                            if rasterTiles
+                            else [geojson_2, info_2]
+                        )
+                        + [
                             colorbar_2,
-                            info_2,
                             # dl.TileLayer(url="https://cartodb-basemaps-{s}.global.ssl.fastly.net/light_nolabels/{z}/{x}/{y}.png"),
                         ],
                         style={
@@ -570,9 +719,67 @@ def main(local):
         ]
     )
 
+    # Serve vector tiles of both maps at tiles/<layer>/<z>/<x>/<y>.pbf, with
+    # the layers 'population' and 'temperature'. Cached tiles are specific
+    # to the version of the data file. No map of the app uses them yet, see
+    # vectortiles.py.
+    def load_vector_tiles():
+        """
+        Make the tiles from the loaded cells.
+        """
+        return VectorTiles(
+            {
+                "population": registry.get("zh_population"),
+                "temperature": registry.get("temp_data"),
+            },
+            directory=tileDirectory
+            and join(tileDirectory, fileVersion("assets/all-data.json"), "mvt"),
+        )
+
+    # Each worker makes the tiles on first use, as they need the
+    # feature dicts.
+    registry.register("vector_tiles", load_vector_tiles, preload=False)
+
+    @dashApp.server.route(
+        dashApp.config.routes_pathname_prefix
+        + "tiles/<layer>/<int:z>/<int:x>/<int:y>.pbf"
+    )
+    def vector_tile(layer, z, x, y):
+        """
+        Serve a vector tile.
+        """
+        try:
+            tile = registry.get("vector_tiles").tile(layer, z, x, y)
+        except (KeyError, ValueError):
+            abort(404)
+        return Response(
+            tile, mimetype=MIMETYPE, headers={"Cache-Control": "max-age=86400"}
+        )
+
+    if rasterTiles:
+
+        @dashApp.server.route(
+            dashApp.config.routes_pathname_prefix
+            + "raster/<band>/<int:z>/<int:x>/<int:y>.png"
+        )
+        def raster_tile(band, z, x, y):
+            """
+            Serve an image tile of the temperature map.
+            """
+            raster_tiles = registry.get("raster_tiles")
+            try:
+                tile = raster_tiles.tile(band, z, x, y)
+            except (KeyError, ValueError):
+                abort(404)
+            return Response(
+                tile,
+                mimetype=raster_tiles.mimetype,
+                headers={"Cache-Control": "max-age=86400"},
+            )
+
     # Callback functions
     @dashApp.callback(
-        Output("geojson", "data"),
+        Output("geojson", "hideout" if idMasks else "data"),
         [
             Input("total-people", "value"),
             Input("old-people", "value"),
@@ -586,22 +793,21 @@ def main(local):
         Callback function that controls the sliders for the population map.
         Suggested by ChatGPT.
         """
-        filtered_features = [
-            feature
-            for feature in zh_population["features"]
-            if feature["properties"]["n_total"] >= value1
-            and feature["properties"]["n_old"] >= value2
-            and feature["properties"]["perc_old"] >= value3
-            and feature["properties"]["average_temp"] >= value4
-        ]
-        if value5 == [1]:
-            filtered_features = [
-                feature
-                for feature in filtered_features
-                if feature["properties"]["average_temp_gis"] == "pos"
-            ]
+        population_index = registry.get("population_index")
+        ids = population_index.filter(
+            {
+                "n_total": value1,
+                "n_old": value2,
+                "perc_old": value3,
+                "average_temp": value4,
+                # Hot spots are stored as 1, see features.HOTSPOTCODES.
+                "average_temp_gis": 1 if value5 == [1] else None,
+            }
+        )
 
-        return {"type": "FeatureCollection", "features": filtered_features}
+        if idMasks:
+            return dict(population_hideout, visible=population_index.bitmap(ids))
+        return population_index.collection(ids)
 
     @dashApp.callback(Output("info", "children"), Input("geojson", "hoverData"))
     def info_hover(feature):
@@ -611,42 +817,57 @@ def main(local):
         """
         return get_info(feature)
 
-    # Callback to update the temperature image according to the slider in the
-    # temperature map
-    dashApp.clientside_callback(
-        """
-    function(x, y){
-        var input_to_day = {
-            0: "average_temp",
-            1: "20220623",
-            2: "20220716",
-            3: "20220717",
-            4: "20220725",
-            5: "20220801",
-            6: "20220802",
-            7: "20220809",
-            8: "20220810"
-        };
-        return {
-            colorscale: y.colorscale,
-            classes: y.classes,
-            style: y.style,
-            colorProp: input_to_day[x],
-            min: y.min,
-            max: y.max
-        };}
-    """,
-        Output("geojson_2", "hideout"),
-        [Input("image", "value"), Input("geojson_2", "hideout")],
-    ),
-
-    @dashApp.callback(Output("info_2", "children"), Input("geojson_2", "hoverData"))
-    def info_hover_2(feature):
-        """
-        Callback function that controls the information displayed on hovering
-        for the temperature map.
+    if rasterTiles:
+        # Callback to switch the image tiles of the temperature map according
+        # to the slider
+        dashApp.clientside_callback(
+            """
+        function(x){
+            const bands = %s;
+            return "%s" + bands[x] + "/{z}/{x}/{y}.png";
+        }
         """
-        return get_info_2(feature)
+            % (json.dumps(image_bands), rasterURL),
+            Output("temperature-tiles", "url"),
+            Input("image", "value"),
+        )
+    else:
+        # Callback to update the temperature image according to the slider in
+        # the temperature map
+        dashApp.clientside_callback(
+            """
+        function(x, y){
+            var input_to_day = {
+                0: "average_temp",
+                1: "20220623",
+                2: "20220716",
+                3: "20220717",
+                4: "20220725",
+                5: "20220801",
+                6: "20220802",
+                7: "20220809",
+                8: "20220810"
+            };
+            return {
+                colorscale: y.colorscale,
+                classes: y.classes,
+                style: y.style,
+                colorProp: input_to_day[x],
+                min: y.min,
+                max: y.max
+            };}
+        """,
+            Output("geojson_2", "hideout"),
+            [Input("image", "value"), Input("geojson_2", "hideout")],
+        ),
+
+        @dashApp.callback(Output("info_2", "children"), Input("geojson_2", "hoverData"))
+        def info_hover_2(feature):
+            """
+            Callback function that controls the information displayed on hovering
+            for the temperature map.
+            """
+            return get_info_2(feature)
 
     return dashApp
 
@@ -666,9 +887,42 @@ if __name__ == "__main__":
         help="Run in local mode. Else assume the app is running on civnb.info",
     )
 
+    parser.add_argument(
+        "--featureCollections",
+        action="store_true",
+        help="Send the cells to show on the population map as "
+        "FeatureCollections instead of bitmaps of their ids.",
+    )
+
+    parser.add_argument(
+        "--tileDirectory",
+        default="tile-cache",
+        help="The directory to cache map tiles in.",
+    )
+
+    parser.add_argument(
+        "--rasterTiles",
+        action="store_true",
+        help="Show the temperature map as image tiles instead of a polygon per "
+        "cell.",
+    )
+
+    parser.add_argument(
+        "--rasterDirectory",
+        default="../data/landsat/resolution",
+        help="The directory with the scene cube and the average temperature "
+        "raster, for --rasterTiles.",
+    )
+
     args = parser.parse_args()
 
-    dashApp = main(args.local)
+    dashApp = main(
+        args.local,
+        not args.featureCollections,
+        args.tileDirectory,
+        args.rasterTiles,
+        args.rasterDirectory,
+    )
 
     dashApp.run_server(debug=True)
 
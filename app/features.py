@@ -0,0 +1,164 @@
+"""
+Filter the features of a GeoJSON FeatureCollection by thresholds on their
+properties without looking at every feature dict.
+
+The filter properties are held as NumPy columns, each with the feature ids
+sorted by value. A threshold is a binary search in the sorted values, which
+gives the ids of the features that pass it. The most selective threshold
+gives the candidate features, and the others are checked on the candidates
+only, so the cost depends on the number of features that pass rather than on
+the number of features.
+
+Only the columns are needed to filter and to make bitmaps of the ids, so an
+index can drop the feature dicts. A process that forks workers, e.g. the
+gunicorn master, then shares a few flat arrays with them instead of a tree of
+dicts and lists, whose pages the workers would copy as soon as they touch
+the reference counts.
+"""
+
+import base64
+
+import numpy as np
+
+# The classes of hot spot cells, as written by bin/make-geojson.py, and the
+# numbers they are stored as, so a hot spot filter is a threshold of 1.
+HOTSPOTCODES = {"pos": 1, "ns": 0, "neg": -1}
+
+
+class FeatureIndex:
+    """
+    Hold columns of the properties of features for fast filtering.
+
+    @param collection: A GeoJSON FeatureCollection C{dict}.
+    @param columns: An iterable of C{str} names of numeric properties to
+        filter by. Missing values (C{None} or NaN) never pass a threshold.
+    @param hotspotColumns: An iterable of C{str} names of properties with hot
+        spot classes (see C{HOTSPOTCODES}) to filter by. They are stored as
+        numbers, under the same names.
+    @param idProperty: The C{str} name of a non-negative integer property
+        that identifies the features in the browser, or C{None} to use the
+        positions of the features.
+    @param keepFeatures: If C{True}, keep the feature dicts, for
+        C{collection}. Else only the columns are kept.
+    """
+
+    def __init__(
+        self,
+        collection,
+        columns=(),
+        hotspotColumns=(),
+        idProperty=None,
+        keepFeatures=True,
+    ):
+        features = collection["features"]
+        self.features = features if keepFeatures else None
+        if idProperty is None:
+            self.ids = np.arange(len(features))
+        else:
+            self.ids = np.array(
+                [feature["properties"][idProperty] for feature in features],
+                dtype="int64",
+            )
+        self.columns = {}
+        for name in columns:
+            self.columns[name] = np.array(
+                [feature["properties"][name] for feature in features],
+                dtype="float64",
+            )
+        for name in hotspotColumns:
+            self.columns[name] = np.array(
+                [
+                    HOTSPOTCODES.get(feature["properties"][name], np.nan)
+                    for feature in features
+                ],
+                dtype="float64",
+            )
+
+        # The ids of the features with values, sorted by value, and the
+        # sorted values.
+        self.order = {}
+        self.sorted = {}
+        for name, column in self.columns.items():
+            present = np.flatnonzero(~np.isnan(column))
+            self.order[name] = present[np.argsort(column[present], kind="stable")]
+            self.sorted[name] = column[self.order[name]]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def atLeast(self, name, value):
+        """
+        Find the features whose property is at least a value.
+
+        @param name: The C{str} name of the property.
+        @param value: The C{float} minimum value.
+        @return: A C{np.ndarray} of feature ids, in the order of the values.
+        """
+        return self.order[name][np.searchsorted(self.sorted[name], value) :]
+
+    def filter(self, minimums):
+        """
+        Find the features whose properties are all at least their minimums.
+
+        @param minimums: A C{dict} mapping the C{str} names of properties to
+            their minimum values. C{None} minimums are ignored.
+        @return: A sorted C{np.ndarray} of feature ids.
+        """
+        minimums = {
+            name: value for name, value in minimums.items() if value is not None
+        }
+        if not minimums:
+            return np.arange(len(self.ids))
+
+        # Start from the threshold that the fewest features pass.
+        passing = {
+            name: len(self.sorted[name]) - np.searchsorted(self.sorted[name], value)
+            for name, value in minimums.items()
+        }
+        first = min(passing, key=passing.get)
+        ids = self.atLeast(first, minimums[first])
+        for name, value in minimums.items():
+            if name != first:
+                ids = ids[self.columns[name][ids] >= value]
+
+        return np.sort(ids)
+
+    def collection(self, ids):
+        """
+        Make a FeatureCollection of some of the features.
+
+        @param ids: An iterable of C{int} feature ids.
+        @raise ValueError: If the index did not keep the features.
+        @return: A GeoJSON FeatureCollection C{dict}.
+        """
+        if self.features is None:
+            raise ValueError("The index did not keep the features.")
+        return {
+            "type": "FeatureCollection",
+            "features": [self.features[i] for i in ids],
+        }
+
+    def bitmap(self, ids):
+        """
+        Encode the browser ids (see C{idProperty}) of some of the features as
+        a bitmap, to send to the browser instead of the features themselves.
+
+        @param ids: An iterable of C{int} feature ids, as returned by
+            C{filter}.
+        @return: A C{str} with the base64 encoded bitmap, see C{idBitmap}.
+        """
+        return idBitmap(self.ids[np.asarray(ids, dtype="int64")])
+
+
+def idBitmap(ids):
+    """
+    Encode non-negative integer ids as a bitmap in which bit i (of byte
+    i // 8, least significant bit first) is set if i is one of the ids.
+
+    @param ids: A C{np.ndarray} of C{int} ids.
+    @return: A C{str} with the base64 encoded bitmap.
+    """
+    ids = np.asarray(ids, dtype="int64")
+    bits = np.zeros(int(ids.max()) + 1 if len(ids) else 0, dtype=bool)
+    bits[ids] = True
+    return base64.b64encode(np.packbits(bits, bitorder="little").tobytes()).decode()
@@ -0,0 +1,200 @@
+"""
+Render XYZ image tiles of the temperature rasters, coloured like the cells of
+the temperature map, so the browser draws images instead of a polygon per
+cell.
+
+The rasters are read with C{giscode}, so the repository root must be on the
+Python path, as the app's Makefile and gunicorn.conf.py do.
+
+Encoding the images needs the optional C{Pillow} package. Without it,
+C{Image} is C{None} and the tiles cannot be rendered.
+"""
+
+import io
+
+import numpy as np
+import rasterio
+from pyproj import Transformer
+
+from giscode.common import NODATAVAL
+from giscode.cube import Cube
+from giscode.raster import findBand, readBand
+from tiles import TileCache, tileBounds, validTile
+
+try:
+    from PIL import Image, ImageColor
+except ImportError:
+    Image = ImageColor = None
+
+# The MIME types of the image formats.
+MIMETYPES = {"png": "image/png", "webp": "image/webp"}
+
+
+def readBands(cube, average):
+    """
+    Read the temperature bands of the image tiles: the scenes of a cube made
+    by bin/build-cube.py, memory mapped, and the mean band of the average
+    temperature raster, decoded whatever storage profile it was written with.
+
+    @param cube: The C{str} name of the cube, without the .npy and .json
+        extensions.
+    @param average: The C{str} filename of the average temperature raster.
+    @return: A C{tuple} with a C{dict} mapping 'average_temp' and the C{str}
+        dates of the scenes to their C{np.ndarray}s, with NaN for missing
+        values, and the C{Cube}, for its grid.
+    """
+    cube = Cube(cube)
+    with rasterio.open(average) as src:
+        averageTemp = readBand(src, findBand(src, "mean"))
+    averageTemp[averageTemp == NODATAVAL] = np.nan
+    return {"average_temp": averageTemp, **dict(zip(cube.dates, cube.data))}, cube
+
+
+def colorize(values, colorscale, domain, opacity=1.0):
+    """
+    Colour values like a C{chroma.scale(colorscale).domain(domain)} scale: the
+    colours are evenly spread over the domain, values in between are
+    interpolated in RGB and values outside are clamped.
+
+    @param values: A C{np.ndarray} of values, with NaN for missing values.
+    @param colorscale: A C{list} of C{str} CSS colours.
+    @param domain: A C{tuple} with the C{float} minimum and maximum values.
+    @param opacity: The C{float} opacity of the colours.
+    @return: A C{uint8} C{np.ndarray} with an extra last axis of RGBA
+        colours. Missing values are transparent.
+    """
+    colors = np.array([ImageColor.getrgb(color)[:3] for color in colorscale])
+    positions = np.linspace(domain[0], domain[1], len(colors))
+    present = ~np.isnan(values)
+    clamped = np.clip(np.where(present, values, domain[0]), *domain)
+
+    rgba = np.zeros(values.shape + (4,), dtype="uint8")
+    for channel in range(3):
+        rgba[..., channel] = np.rint(
+            np.interp(clamped, positions, colors[:, channel])
+        ).astype("uint8")
+    rgba[..., 3] = np.where(present, round(opacity * 255), 0)
+    return rgba
+
+
+class RasterTiles:
+    """
+    Render and cache image tiles of rasters on the same grid.
+
+    @param bands: A C{dict} mapping C{str} band names, e.g. dates, to 2D
+        C{np.ndarray}s with NaN for missing values.
+    @param transform: The C{Affine} transform of the grid.
+    @param crs: The CRS of the grid, anything C{pyproj} accepts.
+    @param colorscale: A C{list} of C{str} CSS colours, see C{colorize}.
+    @param domain: A C{tuple} with the C{float} minimum and maximum values of
+        the colour scale.
+    @param opacity: The C{float} opacity of the cells.
+    @param directory: The C{str} directory to cache tiles on disk in, or
+        C{None}. See C{tiles.TileCache}.
+    @param size: The C{int} maximum number of tiles to keep in memory.
+    @param tileSize: The C{int} width and height of the tiles in pixels.
+    @param format: The C{str} image format, 'png' or 'webp'.
+    @raise ValueError: If the format is unknown or Pillow is not installed.
+    """
+
+    def __init__(
+        self,
+        bands,
+        transform,
+        crs,
+        colorscale,
+        domain,
+        opacity=0.9,
+        directory=None,
+        size=1024,
+        tileSize=256,
+        format="png",
+    ):
+        if Image is None:
+            raise ValueError("Rendering image tiles needs Pillow.")
+        if format not in MIMETYPES:
+            raise ValueError(
+                f"Unknown format {format!r}. Use one of {', '.join(MIMETYPES)}."
+            )
+        self.bands = bands
+        self.inverse = ~transform
+        self.colorscale = colorscale
+        self.domain = domain
+        self.opacity = opacity
+        self.tileSize = tileSize
+        self.format = format
+        self.mimetype = MIMETYPES[format]
+        self.cache = TileCache(self.render, directory, size, "." + format)
+        self.toGrid = Transformer.from_crs("EPSG:3857", crs, always_xy=True)
+
+        # The bounds of the grid in Web Mercator, to skip tiles outside it.
+        height, width = next(iter(bands.values())).shape
+        west, north = transform * (0, 0)
+        east, south = transform * (width, height)
+        self.bounds = self.toGrid.transform_bounds(
+            west, south, east, north, direction="INVERSE"
+        )
+        self.empty = self._encode(np.zeros((tileSize, tileSize, 4), dtype="uint8"))
+
+    def _encode(self, rgba):
+        buffer = io.BytesIO()
+        Image.fromarray(rgba, "RGBA").save(buffer, format=self.format)
+        return buffer.getvalue()
+
+    def render(self, name, z, x, y):
+        """
+        Render a tile. Every pixel gets the colour of the cell its centre is
+        in.
+
+        @param name: The C{str} name of the band.
+        @param z: The C{int} zoom level.
+        @param x: The C{int} column of the tile.
+        @param y: The C{int} row of the tile.
+        @return: The C{bytes} of the image.
+        """
+        west, south, east, north = tileBounds(z, x, y)
+        if (
+            east < self.bounds[0]
+            or west > self.bounds[2]
+            or north < self.bounds[1]
+            or south > self.bounds[3]
+        ):
+            return self.empty
+
+        band = self.bands[name]
+        pixel = (east - west) / self.tileSize
+        centres = (np.arange(self.tileSize) + 0.5) * pixel
+        xs, ys = np.meshgrid(west + centres, north - centres)
+        gridX, gridY = self.toGrid.transform(xs, ys)
+        cols, rows = self.inverse * (gridX, gridY)
+        cols = np.floor(cols).astype("int64")
+        rows = np.floor(rows).astype("int64")
+        inside = (
+            (rows >= 0) & (rows < band.shape[0]) & (cols >= 0) & (cols < band.shape[1])
+        )
+
+        values = np.full(xs.shape, np.nan)
+        values[inside] = band[rows[inside], cols[inside]]
+        if np.isnan(values).all():
+            return self.empty
+        return self._encode(
+            colorize(values, self.colorscale, self.domain, self.opacity)
+        )
+
+    def tile(self, name, z, x, y):
+        """
+        Get a tile from the cache, rendering it if needed.
+
+        @param name: The C{str} name of the band.
+        @param z: The C{int} zoom level.
+        @param x: The C{int} column of the tile.
+        @param y: The C{int} row of the tile.
+        @raise KeyError: If the band is unknown.
+        @raise ValueError: If the tile does not exist.
+        @return: The C{bytes} of the image.
+        """
+        if name not in self.bands:
+            raise KeyError(name)
+        if not validTile(z, x, y):
+            raise ValueError(f"There is no tile {z}/{x}/{y}.")
+        return self.cache.get(name, z, x, y)
@@ -0,0 +1,100 @@
+"""
+A registry of the datasets of the app. Datasets are registered with a
+function that loads them, and are only loaded when they are first used, or
+all at once by C{load}.
+
+Under gunicorn with C{preload_app}, the master process loads the datasets
+before it forks the workers (see gunicorn.conf.py), so the workers share
+them copy-on-write instead of each parsing their own copy. C{reload} loads
+new data, e.g. from gunicorn's C{on_reload} hook on SIGHUP, before new
+workers are forked.
+
+Sharing only works for datasets of a few large objects, such as NumPy
+arrays: a worker that reads a dict or list writes to its reference count,
+which copies the page it is on. Datasets of many small objects are
+registered with C{preload=False}, so C{load} leaves them to the workers that
+need them.
+"""
+
+import threading
+
+
+class Registry:
+    """
+    Lazily load named datasets.
+    """
+
+    def __init__(self):
+        self.loaders = {}
+        self.preload = set()
+        self.datasets = {}
+        # Loaders may get other datasets, so the lock is re-entrant.
+        self.lock = threading.RLock()
+
+    def register(self, name, loader, preload=True):
+        """
+        Register a dataset. A dataset of the same name is replaced.
+
+        @param name: The C{str} name of the dataset.
+        @param loader: A function without arguments that returns the dataset.
+            It may get other datasets from the registry.
+        @param preload: If C{True}, C{load} loads the dataset. Else it is only
+            loaded when it is first used.
+        """
+        with self.lock:
+            self.loaders[name] = loader
+            if preload:
+                self.preload.add(name)
+            else:
+                self.preload.discard(name)
+            self.datasets.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self.loaders
+
+    def get(self, name):
+        """
+        Get a dataset, loading it if it is not loaded yet.
+
+        @param name: The C{str} name of the dataset.
+        @raise KeyError: If the dataset is not registered.
+        @return: The dataset.
+        """
+        with self.lock:
+            if name not in self.datasets:
+                self.datasets[name] = self.loaders[name]()
+            return self.datasets[name]
+
+    def loaded(self):
+        """
+        Get the names of the loaded datasets.
+
+        @return: A C{list} of C{str} names, in the order they were loaded.
+        """
+        with self.lock:
+            return list(self.datasets)
+
+    def load(self):
+        """
+        Load all datasets registered with C{preload} that are not loaded yet.
+        """
+        with self.lock:
+            for name in self.loaders:
+                if name in self.preload:
+                    self.get(name)
+
+    def reload(self):
+        """
+        Forget all loaded datasets and load them again, so datasets that
+        depend on others are rebuilt too. Datasets that were not loaded stay
+        unloaded.
+        """
+        with self.lock:
+            names = self.loaded()
+            self.datasets.clear()
+            for name in names:
+                self.get(name)
+
+
+# The registry of the app.
+registry = Registry()
@@ -0,0 +1,146 @@
+"""
+Helpers for serving XYZ map tiles: Web Mercator tile maths and a tile cache
+that keeps recently used tiles in memory and all rendered tiles on disk.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from os.path import dirname, exists, join
+
+import numpy as np
+
+# Half the circumference of the earth in Web Mercator (EPSG:3857) metres.
+ORIGIN = 20037508.342789244
+
+
+def mercator(lon, lat):
+    """
+    Project longitudes and latitudes to Web Mercator.
+
+    @param lon: A C{float} or C{np.ndarray} of longitudes.
+    @param lat: A C{float} or C{np.ndarray} of latitudes.
+    @return: A C{tuple} with the x and y coordinates in metres.
+    """
+    x = np.radians(lon) * (ORIGIN / np.pi)
+    y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * (ORIGIN / np.pi)
+    return x, y
+
+
+def tileBounds(z, x, y):
+    """
+    Compute the bounds of an XYZ tile in Web Mercator.
+
+    @param z: The C{int} zoom level.
+    @param x: The C{int} column of the tile, from the west.
+    @param y: The C{int} row of the tile, from the north.
+    @return: A C{tuple} with the west, south, east and north coordinates of the
+        tile in metres.
+    """
+    size = 2 * ORIGIN / 2**z
+    west = -ORIGIN + x * size
+    north = ORIGIN - y * size
+    return west, north - size, west + size, north
+
+
+def fileVersion(*filenames):
+    """
+    Make a version string of files, to keep the cached tiles of different
+    versions of the data apart.
+
+    @param filenames: The C{str} names of the files.
+    @return: A C{str} made from the modification times and sizes of the
+        files.
+    """
+    parts = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        parts.append(f"{stat.st_mtime_ns}-{stat.st_size}")
+    return "-".join(parts)
+
+
+def validTile(z, x, y):
+    """
+    Check that a tile exists.
+
+    @param z: The C{int} zoom level.
+    @param x: The C{int} column of the tile.
+    @param y: The C{int} row of the tile.
+    @return: C{True} if the tile is on the map at its zoom level.
+    """
+    return z >= 0 and 0 <= x < 2**z and 0 <= y < 2**z
+
+
+class TileCache:
+    """
+    Cache rendered tiles in memory, least recently used first out, and
+    optionally on disk. It is safe to use from several threads.
+
+    @param render: A function that renders a tile given the parts of its key
+        and returns C{bytes}.
+    @param directory: The C{str} directory to cache tiles on disk in, or
+        C{None} to only cache them in memory. Tiles are stored as
+        C{<directory>/<key parts>.<suffix>}, so the directory should be
+        specific to the data the tiles are rendered from.
+    @param size: The C{int} maximum number of tiles to keep in memory.
+    @param suffix: The C{str} suffix of the tile files on disk.
+    """
+
+    def __init__(self, render, directory=None, size=1024, suffix=""):
+        self.render = render
+        self.directory = directory
+        self.size = size
+        self.suffix = suffix
+        self.tiles = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def _filename(self, key):
+        return join(self.directory, *map(str, key)) + self.suffix
+
+    def get(self, *key):
+        """
+        Get a tile, rendering it if it is not cached.
+
+        @param key: The parts of the key of the tile, e.g. layer, z, x and y.
+        @return: The C{bytes} of the tile.
+        """
+        with self.lock:
+            if key in self.tiles:
+                self.tiles.move_to_end(key)
+                return self.tiles[key]
+
+        tile = None
+        if self.directory is not None:
+            filename = self._filename(key)
+            if exists(filename):
+                with open(filename, "rb") as fp:
+                    tile = fp.read()
+
+        if tile is None:
+            tile = self.render(*key)
+            if self.directory is not None:
+                # Write to a temporary file first, so other processes never
+                # read a partial tile.
+                os.makedirs(dirname(filename), exist_ok=True)
+                tmp = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, "wb") as fp:
+                    fp.write(tile)
+                os.replace(tmp, filename)
+
+        with self.lock:
+            self.tiles[key] = tile
+            self.tiles.move_to_end(key)
+            while len(self.tiles) > self.size:
+                self.tiles.popitem(last=False)
+
+        return tile
+
+    def clear(self):
+        """
+        Forget the tiles in memory. Tiles on disk are kept.
+        """
+        with self.lock:
+            self.tiles.clear()
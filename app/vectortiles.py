@@ -0,0 +1,116 @@
+"""
+Render Mapbox Vector Tiles (MVT) of the grid cells of GeoJSON
+FeatureCollections, so a map only needs to load the cells it shows.
+
+No map of the app uses the tiles yet: the maps still load the GeoJSON
+files, as dash-leaflet has no vector tile layer. The tiles are served for
+clients that have one, e.g. Leaflet.VectorGrid or MapLibre.
+
+The tiles are encoded with the C{mapbox_vector_tile} package.
+"""
+
+import mapbox_vector_tile
+import numpy as np
+import shapely
+
+from tiles import TileCache, mercator, tileBounds, validTile
+
+# The MIME type of vector tiles.
+MIMETYPE = "application/vnd.mapbox-vector-tile"
+
+
+class VectorTiles:
+    """
+    Render and cache vector tiles of layers of polygons.
+
+    @param layers: A C{dict} mapping C{str} layer names to GeoJSON
+        FeatureCollection C{dict}s of grid cells in WGS84.
+    @param directory: The C{str} directory to cache tiles on disk in, or
+        C{None}. See C{tiles.TileCache}.
+    @param size: The C{int} maximum number of tiles to keep in memory.
+    @param minZoom: The C{int} lowest zoom level to render tiles for. Tiles
+        of lower zoom levels are empty, because they would contain every cell.
+    @param extent: The C{int} extent of the tiles, in tile coordinates.
+    """
+
+    def __init__(self, layers, directory=None, size=1024, minZoom=10, extent=4096):
+        self.layers = layers
+        self.minZoom = minZoom
+        self.extent = extent
+        self.cache = TileCache(self.render, directory, size, ".pbf")
+        # The cells of each layer, in Web Mercator, with a spatial index.
+        # They are made on first use.
+        self.cells = {}
+
+    def _cells(self, name):
+        if name not in self.cells:
+            features = self.layers[name]["features"]
+            # The cells are quadrilaterals, so their rings fit in one array.
+            rings = np.array(
+                [feature["geometry"]["coordinates"][0] for feature in features]
+            )
+            geometries = shapely.polygons(
+                np.stack(mercator(rings[..., 0], rings[..., 1]), axis=-1)
+            )
+            # MVT cannot encode missing values, so leave them out.
+            properties = [
+                {
+                    key: value
+                    for key, value in feature["properties"].items()
+                    if value is not None
+                }
+                for feature in features
+            ]
+            self.cells[name] = (geometries, properties, shapely.STRtree(geometries))
+        return self.cells[name]
+
+    def render(self, name, z, x, y):
+        """
+        Render a tile.
+
+        @param name: The C{str} name of the layer.
+        @param z: The C{int} zoom level.
+        @param x: The C{int} column of the tile.
+        @param y: The C{int} row of the tile.
+        @return: The C{bytes} of the MVT tile, with a single layer called
+            C{name}. Tiles without cells are empty.
+        """
+        if z < self.minZoom:
+            return b""
+
+        geometries, properties, tree = self._cells(name)
+        bounds = tileBounds(z, x, y)
+        found = np.sort(tree.query(shapely.box(*bounds), predicate="intersects"))
+        if not len(found):
+            return b""
+
+        return mapbox_vector_tile.encode(
+            [
+                {
+                    "name": name,
+                    "features": [
+                        {"geometry": geometries[i], "properties": properties[i]}
+                        for i in found
+                    ],
+                }
+            ],
+            default_options={"quantize_bounds": bounds, "extents": self.extent},
+        )
+
+    def tile(self, name, z, x, y):
+        """
+        Get a tile from the cache, rendering it if needed.
+
+        @param name: The C{str} name of the layer.
+        @param z: The C{int} zoom level.
+        @param x: The C{int} column of the tile.
+        @param y: The C{int} row of the tile.
+        @raise KeyError: If the layer is unknown.
+        @raise ValueError: If the tile does not exist.
+        @return: The C{bytes} of the MVT tile.
+        """
+        if name not in self.layers:
+            raise KeyError(name)
+        if not validTile(z, x, y):
+            raise ValueError(f"There is no tile {z}/{x}/{y}.")
+        return self.cache.get(name, z, x, y)
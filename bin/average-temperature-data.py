@@ -1,83 +1,109 @@
 #! usr/bin/env/python
 
 import argparse
-import rasterio
-import numpy as np
-from giscode.common import GOODSCENES, PROCLSDIR, NODATAVAL
-from os.path import join
-
-
-def main(outRaster):
+from giscode.common import GOODSCENES
+from giscode.composite import composite, compositeCube
+from giscode.cube import CUBE, getCube
+from giscode.raster import STORAGE, writeRaster
+
+
+def main(
+    outRaster,
+    reducers=("mean",),
+    scenes=None,
+    storage="float64",
+    cog=False,
+    cube=CUBE,
+):
     """
-    Average temperature values from different input rasters.
-
-    @param outRaster: The C{str} filename that the averaged raster will be
-        written to.
+    Combine the temperature values of different input rasters into a
+    composite. By default the temperatures are averaged.
+
+    @param outRaster: The C{str} filename that the composite raster will be
+        written to. It has one band per reducer, described by its name.
+    @param reducers: An iterable of C{str} reducer names, see
+        C{giscode.composite}.
+    @param scenes: A C{list} of C{str} filenames of the scenes to combine,
+        which are read directly, or C{None} to combine the good scenes from
+        the scene cube.
+    @param storage: The C{str} storage profile of the output, see
+        C{giscode.raster}.
+    @param cog: If C{True}, write a Cloud-Optimized GeoTIFF with overviews.
+    @param cube: The C{str} filename of the scene cube without extension. It
+        is built first if it is missing or out of date.
     """
-    # Instantiate the arrays
-    arr = np.zeros((203, 205))
-    arrCount = np.zeros((203, 205))
-
-    # Loop through each scene, and at each pixel keep track of whether it has a
-    # valid temperature and how many valid temperature readings there are at
-    # each pixel. Then average temperature readings from all scenes with
-    # available data.
-    for file in GOODSCENES:
-        ls = rasterio.open(file)
-
-        counts = ls.read(1)
-        counts[counts != NODATAVAL] = 1
-        counts[counts == NODATAVAL] = 0
-
-        arrCount += counts
-
-        d = ls.read(1)
-        d[d == NODATAVAL] = 0
+    # Pixels without any valid temperature are NaN and written as no-data.
+    if scenes:
+        results, transform, crs = composite(list(scenes), reducers)
+    else:
+        results, transform, crs = compositeCube(getCube(GOODSCENES, cube), reducers)
+
+    writeRaster(
+        outRaster,
+        list(results.values()),
+        crs,
+        transform,
+        storage,
+        descriptions=list(results),
+        cog=cog,
+    )
 
-        arr += d
 
-        ls.close()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="Combine landsat temperature scenes into a composite.",
+    )
 
-    # Average scenes
-    arr = arr / arrCount
+    parser.add_argument("--outRaster", help="The name of the output file.")
 
-    # Save the average array
-    # Open a source file
-    tempRaster = rasterio.open(
-        join(
-            PROCLSDIR, "LC08_L2SP_194027_20220623_20220705_02_T1_ST_B10-resolution.TIF"
-        )
+    parser.add_argument(
+        "--reducer",
+        action="append",
+        dest="reducers",
+        help=(
+            "How to combine the scenes: count, mean, min, max, variance, std, "
+            "median or a percentile such as p90. May be repeated to write one "
+            "band per reducer. Defaults to mean."
+        ),
     )
 
-    kwargs = tempRaster.meta.copy()
-    kwargs.update(
-        {
-            "driver": "GTiff",
-            "width": tempRaster.shape[1],
-            "height": tempRaster.shape[0],
-            "count": 1,
-            "dtype": "float64",
-            "crs": tempRaster.crs,
-            "transform": tempRaster.transform,
-            "nodata": NODATAVAL,
-        }
+    parser.add_argument(
+        "--scene",
+        action="append",
+        dest="scenes",
+        help=(
+            "A scene to combine, read directly from its raster. May be "
+            "repeated. Defaults to the good scenes in the scene cube."
+        ),
     )
 
-    # Write the output file
-    with rasterio.open(fp=outRaster, mode="w", **kwargs) as dst:
-        dst.write(arr, 1)
-
-    tempRaster.close()
-
+    parser.add_argument(
+        "--cube",
+        default=CUBE,
+        help="The filename of the scene cube, without the .npy/.json extension.",
+    )
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-        description="Mask clouds in landsat data.",
+    parser.add_argument(
+        "--storage",
+        default="float64",
+        choices=tuple(STORAGE),
+        help="The storage profile of the output file.",
     )
 
-    parser.add_argument("--outRaster", help="The name of the output file.")
+    parser.add_argument(
+        "--cog",
+        action="store_true",
+        help="Write a Cloud-Optimized GeoTIFF with overviews.",
+    )
 
     args = parser.parse_args()
 
-    main(args.outRaster)
+    main(
+        args.outRaster,
+        args.reducers or ["mean"],
+        args.scenes,
+        args.storage,
+        args.cog,
+        args.cube,
+    )
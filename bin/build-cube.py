@@ -0,0 +1,52 @@
+#! usr/bin/env/python
+
+import argparse
+
+from giscode.common import GOODSCENES
+from giscode.cube import CUBE, buildCube
+
+
+def main(scenes, cube, force):
+    """
+    Pack the preprocessed scenes into a memory mapped scene cube, see
+    C{giscode.cube}.
+
+    @param scenes: A C{list} of C{str} filenames of the scenes.
+    @param cube: The C{str} filename of the cube without extension.
+    @param force: If C{True}, rebuild the cube even if it is up to date.
+    """
+    cube = buildCube(scenes, cube, force)
+    print(
+        f"{len(cube)} scenes ({', '.join(cube.dates)}) on a "
+        f"{cube.shape[0]}x{cube.shape[1]} grid."
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="Pack landsat scenes into a scene cube.",
+    )
+
+    parser.add_argument(
+        "--scene",
+        action="append",
+        dest="scenes",
+        help="A scene to add. May be repeated. Defaults to the good scenes.",
+    )
+
+    parser.add_argument(
+        "--cube",
+        default=CUBE,
+        help="The filename of the cube, without the .npy/.json extension.",
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rebuild the cube, even if the scenes did not change.",
+    )
+
+    args = parser.parse_args()
+
+    main(args.scenes or GOODSCENES, args.cube, args.force)
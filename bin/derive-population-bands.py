@@ -0,0 +1,86 @@
+#! usr/bin/env/python
+
+import argparse
+
+from giscode.population import bandScales, derive, readBands
+from giscode.raster import STORAGE, writeRaster
+
+
+def main(inRaster, outRaster, expressions, keep=False, storage="float64", cog=False):
+    """
+    Compute derived indicators from a rasterised population dataset, without
+    going back to the CSV file.
+
+    @param inRaster: The C{str} filename of a population raster written by
+        rasterise-population-data.py.
+    @param outRaster: The C{str} filename that the new bands will be written
+        to.
+    @param expressions: A C{list} of C{str} band expressions over the band
+        names of C{inRaster}, see C{giscode.population}.
+    @param keep: If C{True}, write the bands of C{inRaster} before the new
+        ones.
+    @param storage: The C{str} storage profile of the output, see
+        C{giscode.raster}.
+    @param cog: If C{True}, write a Cloud-Optimized GeoTIFF with overviews.
+    """
+    bands, crs, transform = readBands(inRaster)
+    derived = derive(bands, expressions)
+    if keep:
+        derived = dict(bands, **derived)
+
+    writeRaster(
+        outRaster,
+        list(derived.values()),
+        crs,
+        transform,
+        storage,
+        scales=bandScales(list(derived.values())),
+        descriptions=list(derived),
+        cog=cog,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="Derive new bands from a population raster.",
+    )
+
+    parser.add_argument("--inRaster", help="The name of the population raster.")
+
+    parser.add_argument("--outRaster", help="The name of the output file.")
+
+    parser.add_argument(
+        "--band",
+        action="append",
+        dest="bands",
+        required=True,
+        help=(
+            "A band to compute as 'name=expression' over the band names of the "
+            "input, e.g. 'share_80plus=J_80PLUS_P / J_65PLUS_P'. May be "
+            "repeated."
+        ),
+    )
+
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="Also write the bands of the input raster.",
+    )
+
+    parser.add_argument(
+        "--storage",
+        default="float64",
+        choices=tuple(STORAGE),
+        help="The storage profile of the output file.",
+    )
+
+    parser.add_argument(
+        "--cog",
+        action="store_true",
+        help="Write a Cloud-Optimized GeoTIFF with overviews.",
+    )
+
+    args = parser.parse_args()
+
+    main(args.inRaster, args.outRaster, args.bands, args.keep, args.storage, args.cog)
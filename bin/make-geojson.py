@@ -1,97 +1,114 @@
 #! usr/bin/env/python
 
+import argparse
 import rasterio
 import numpy as np
-from shapely import Polygon
 import geopandas as gpd
-from pysal.explore import esda
-from pysal.lib import weights
 from os.path import join
 
-from giscode.common import GOODSCENES, PROCLSDIR, BEVDIR, TOPDIR, NODATAVAL
-
-
-def main():
+from giscode.common import PROCLSDIR, BEVDIR, TOPDIR, NODATAVAL
+from giscode.cube import getCube
+from giscode.export import FORMATS, writeLayer
+from giscode.grid import cornerLattice, latticePolygons, latticeWeights
+from giscode.hotspot import CORRECTIONS, hotspots
+from giscode.raster import findBand, readBand
+
+
+def main(
+    permutations=0,
+    seed=12345,
+    jobs=1,
+    alpha=0.05,
+    correction="none",
+    formats=("geojson",),
+    precision=None,
+):
     """
-    Function to aggregate all data in two GeoJSON files, one containing all
-    cells within the city of Zurich and the other only containing those cells
-    that are inhabited.
+    Function to aggregate all data in one GeoJSON file containing all cells
+    within the city of Zurich. The 'populated' column flags the cells that
+    are inhabited.
+
+    @param permutations: The C{int} number of permutations for the p-values
+        of the hot spots, or 0 to use analytic p-values. Permutations are run
+        for each column separately, so they take much longer.
+    @param seed: The C{int} seed of the permutations.
+    @param jobs: The C{int} number of processes for the permutations. Use 0
+        for one per CPU.
+    @param alpha: The C{float} significance level of the hot spots.
+    @param correction: The C{str} correction of the p-values for testing
+        many cells, see C{giscode.hotspot}.
+    @param formats: An iterable of C{str} formats to write the files in, see
+        C{giscode.export}.
+    @param precision: The C{int} number of decimals of the coordinates, or
+        C{None} for full precision (TopoJSON: 6 decimals).
     """
     columns = {}
-    # Read temperature values
-    for i, file in enumerate(GOODSCENES):
-        with rasterio.open(file) as src:
-            image = src.read(1).astype("float64")
-            name = file.split("_")[3]
-            columns[name] = image.flatten()
+    # Read temperature values from the scene cube, one column per date
+    cube = getCube()
+    for date, image in zip(cube.dates, cube.data):
+        column = image.astype("float64").ravel()
+        column[np.isnan(column)] = NODATAVAL
+        columns[date] = column
 
     # Read bevoelkerungsstatistik
     with rasterio.open(join(BEVDIR, "BEVOELKERUNG_HA_P-raster-clipped.TIF")) as src:
-        image1 = src.read(1).astype("float64")
-        image2 = src.read(2).astype("float64")
-        image3 = src.read(3).astype("float64")
+        image1 = readBand(src, 1)
+        image2 = readBand(src, 2)
+        image3 = readBand(src, 3)
 
         columns["perc_old"] = image1.flatten()
         columns["n_old"] = image2.flatten()
         columns["n_total"] = image3.flatten()
 
-    # Generate the polygons
+    # Read the average temperature
     with rasterio.open(join(PROCLSDIR, "average-resolution.TIF")) as src:
-        image4 = src.read(1).astype("float64")
-
+        # The average raster has a band per reducer, see
+        # bin/average-temperature-data.py.
+        image4 = readBand(src, findBand(src, "mean"))
         columns["average_temp"] = image4.flatten()
-
         transform = src.transform
-
-        polygons = []
-        for row in range(src.height):
-            for col in range(src.width):
-                # Get the coordinates of the pixel, suggested by ChatGPT
-                lon, lat = rasterio.transform.xy(transform, row, col)
-                # Create a polygon for the pixel
-                polygon = Polygon(
-                    [
-                        [lon, lat],
-                        [lon + transform.a, lat],
-                        [lon + transform.a, lat - transform.e],
-                        [lon, lat - transform.e],
-                        [lon, lat],
-                    ]
-                )
-                polygons.append(polygon)
-
-    # Generate geodataframe
-    data = gpd.GeoDataFrame(columns, geometry=polygons, crs="EPSG:2056")
-
-    # Convert coordinate system
-    data = data.to_crs("EPSG:4326")
-
-    # Drop empty cells
-    data.dropna(subset=["average_temp"], inplace=True)
-
-    # # Calculate Getis-Ord Gi* statistic for average_temp
-    # # Make weight matrix
-    w = weights.KNN.from_dataframe(data, k=8)
-    # Row-standardization
-    w.transform = "R"
-    # # Calculate G statistic
-    go_i_star = esda.getisord.G_Local(data["average_temp"], w, star=True)
-    # Add results to data frame
-    result = []
-    for p, z in zip(go_i_star.p_sim, go_i_star.Zs):
-        if p > 0.05:
-            result.append("ns")
-        else:
-            if z > 0:
-                result.append("pos")
-            elif z <= 0:
-                result.append("neg")
-    data["average_temp_gis"] = result
-
-    # Drop cells without population data
-    popData = data.loc[data.n_total != NODATAVAL]
-
-    # Convert to GeoJSON
+        shape = src.shape
+        crs = src.crs
+
+    # Only keep cells with a valid average temperature, and make the polygons
+    # of those cells in one go, directly in WGS84. Only the corners of the
+    # grid are reprojected, once each. The index is the number of the cell in
+    # the grid.
+    valid = image4 != NODATAVAL
+    rows, cols = np.nonzero(valid)
+    lattice = cornerLattice(transform, shape, crs, "EPSG:4326")
+    data = gpd.GeoDataFrame(
+        {name: column[valid.ravel()] for name, column in columns.items()},
+        geometry=latticePolygons(lattice, rows, cols),
+        index=np.flatnonzero(valid),
+        crs="EPSG:4326",
+    )
+
+    # Calculate the Getis-Ord Gi* statistic of every date, the average
+    # temperature and the population columns in one go, and add a
+    # '<column>_gis' column with the hot spot class of each. Missing values of
+    # a column are left out of its statistic. The neighbours of a cell are the
+    # (up to) 8 cells around it and the cell itself, found from the grid
+    # instead of by a nearest neighbour search. The weights are row
+    # standardised like before, but the z-scores are not on the scale of
+    # esda's, see giscode/hotspot.py, so some cells get another class.
+    variables = list(cube.dates) + ["average_temp", "perc_old", "n_old", "n_total"]
+    values = np.array(data[variables], dtype="float64")
+    values[values == NODATAVAL] = np.nan
+    w = latticeWeights(valid, includeSelf=True, rowStandardise=True)
+    _, _, classes = hotspots(values, w, alpha, correction, permutations, seed, jobs)
+    for variable, column in zip(variables, classes.T):
+        data[variable + "_gis"] = column
+
+    # Flag the cells with population data. The population map of the app
+    # shows those cells only, so a single file serves both maps.
+    data["populated"] = data.n_total != NODATAVAL
+
+    # Keep the number of the cell in the grid as a property, so the app can
+    # refer to cells by id.
+    data["fid"] = data.index
+
+    # Convert to GeoJSON and the other formats
     # I originally used this code to save the files within the working
     # directory that I wrote the app in. Keeping this in for the record.
     # popData.to_file(
@@ -100,9 +117,80 @@ def main():
     # data.to_file(
     #     'notebooks/240420-playing-with-interactive-maps/assets/all-data.json',
     #     driver="GeoJSON")
-    popData.to_file(join(TOPDIR, "data", "geojson", "pop-data.json"), driver="GeoJSON")
-    data.to_file(join(TOPDIR, "data", "geojson", "all-data.json"), driver="GeoJSON")
+    writeLayer(
+        data,
+        join(TOPDIR, "data", "geojson", "all-data"),
+        formats,
+        rows,
+        cols,
+        lattice,
+        precision,
+        hotspotColumns=[variable + "_gis" for variable in variables],
+    )
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="Make the GeoJSON file for the web app.",
+    )
+
+    parser.add_argument(
+        "--permutations",
+        type=int,
+        default=0,
+        help="The number of permutations for the hot spot p-values of each "
+        "column, e.g. 999. Use 0 for analytic p-values.",
+    )
+
+    parser.add_argument(
+        "--seed", type=int, default=12345, help="The seed of the permutations."
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="The number of processes for the permutations. Use 0 for one per CPU.",
+    )
+
+    parser.add_argument(
+        "--alpha",
+        type=float,
+        default=0.05,
+        help="The significance level of the hot spots.",
+    )
+
+    parser.add_argument(
+        "--correction",
+        default="none",
+        choices=CORRECTIONS,
+        help="How to correct the hot spot p-values for testing many cells.",
+    )
+
+    parser.add_argument(
+        "--format",
+        action="append",
+        dest="formats",
+        choices=tuple(FORMATS),
+        help="A format to write the files in. May be repeated. Defaults to geojson.",
+    )
+
+    parser.add_argument(
+        "--precision",
+        type=int,
+        help="The number of decimals of the coordinates, e.g. 6 (about 10cm). "
+        "Defaults to full precision, and 6 for TopoJSON.",
+    )
+
+    args = parser.parse_args()
+
+    main(
+        args.permutations,
+        args.seed,
+        args.jobs,
+        args.alpha,
+        args.correction,
+        args.formats or ["geojson"],
+        args.precision,
+    )
@@ -2,37 +2,39 @@
 
 
 import argparse
-import numpy as np
+from functools import partial
+
 import rasterio
 
 from giscode.common import NODATAVAL
+from giscode.landsat import maskClouds
+from giscode.qa import POLICIES
+from giscode.raster import STORAGE, processBlocks, readBand, writeRaster
 
 
-def main(inRaster, outRaster):
+def main(
+    inRaster, outRaster, blocks=False, policy="strict", storage="float64", cog=False
+):
     """
-    Mask the clouds in landsat data. Be conservative and mask everything not
-    marked as 'Clear' (21824).
+    Mask the clouds in landsat data. By default, be conservative and mask
+    everything not marked as 'Clear' (21824).
 
     @param inRaster: The C{str} name of the input file. Must be a Landsat 8 or
         9 file containint Surface Temperature information ending in *_B10.TIF.
     @param outRaster: The C{str} filename that the rescaled raster will be
         written to.
+    @param blocks: If C{True}, stream the rasters block by block, so that
+        memory use is bounded by the block size instead of the raster size.
+    @param policy: The C{str} name of the mask policy that decides which
+        pixels are usable, see C{giscode.qa}.
+    @param storage: The C{str} storage profile of the output, see
+        C{giscode.raster}.
+    @param cog: If C{True}, write a Cloud-Optimized GeoTIFF with overviews.
     """
     # Open the file
     tempRaster = rasterio.open(inRaster)
-    tempData = tempRaster.read(1)
-
-    qaRaster = rasterio.open(inRaster[0:-19] + "_QA_PIXEL-clipped.TIF")
-    qaData = qaRaster.read(1)
-
-    # Create the mask (clear pixels only)
-    qaData[qaData != 21824] = 1
-    qaData[qaData == 21824] = 0
+    qaFile = inRaster[0:-19] + "_QA_PIXEL-clipped.TIF"
 
-    # Mask out the surface temperature data
-    masked = np.ma.masked_array(tempData, mask=qaData)
-
-    # Write the output file
     kwargs = tempRaster.meta.copy()
     kwargs.update(
         {
@@ -47,11 +49,34 @@ def main(inRaster, outRaster):
         }
     )
 
-    with rasterio.open(fp=outRaster, mode="w", **kwargs) as dst:
-        dst.write(masked, 1)
-
-    tempRaster.close()
-    qaRaster.close()
+    # Mask out the surface temperature data (usable pixels only)
+    mask = partial(maskClouds, policy=policy)
+    if blocks:
+        tempRaster.close()
+        processBlocks(
+            [inRaster, qaFile],
+            outRaster,
+            kwargs,
+            mask,
+            storage,
+            decode=(True,),
+            cog=cog,
+        )
+    else:
+        tempData = readBand(tempRaster)
+        tempRaster.close()
+
+        with rasterio.open(qaFile) as qaRaster:
+            masked = mask(tempData, qaRaster.read(1))
+
+        writeRaster(
+            outRaster,
+            [masked],
+            tempRaster.crs,
+            tempRaster.transform,
+            storage,
+            cog=cog,
+        )
 
 
 if __name__ == "__main__":
@@ -66,6 +91,39 @@ if __name__ == "__main__":
 
     parser.add_argument("--outRaster", help="The name of the output file.")
 
+    parser.add_argument(
+        "--blocks",
+        action="store_true",
+        help="Process the rasters block by block to bound memory use.",
+    )
+
+    parser.add_argument(
+        "--policy",
+        default="strict",
+        choices=tuple(POLICIES),
+        help="The mask policy that decides which pixels are usable.",
+    )
+
+    parser.add_argument(
+        "--storage",
+        default="float64",
+        choices=tuple(STORAGE),
+        help="The storage profile of the output file.",
+    )
+
+    parser.add_argument(
+        "--cog",
+        action="store_true",
+        help="Write a Cloud-Optimized GeoTIFF with overviews.",
+    )
+
     args = parser.parse_args()
 
-    main(args.inRaster, args.outRaster)
+    main(
+        args.inRaster,
+        args.outRaster,
+        args.blocks,
+        args.policy,
+        args.storage,
+        args.cog,
+    )
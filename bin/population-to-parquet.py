@@ -0,0 +1,41 @@
+#! usr/bin/env/python
+
+import argparse
+
+from giscode.population import toParquet
+
+
+def main(inCsv, outParquet, rowGroupSize=2048):
+    """
+    Convert the population statistics CSV file to a typed Parquet file, with
+    nullable columns instead of -999, which the other steps read faster.
+
+    @param inCsv: The C{str} name of the input CSV file.
+    @param outParquet: The C{str} filename that the Parquet file will be
+        written to.
+    @param rowGroupSize: The C{int} maximum number of cells per row group.
+    """
+    toParquet(inCsv, outParquet, rowGroupSize)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="Convert the population dataset to Parquet.",
+    )
+
+    parser.add_argument("--inCsv", help="The name of the input CSV file.")
+
+    parser.add_argument("--outParquet", help="The name of the output file.")
+
+    parser.add_argument(
+        "--rowGroupSize",
+        type=int,
+        default=2048,
+        help="The maximum number of cells per row group. Smaller row groups "
+        "let readers skip more of the file when reading a bounding box.",
+    )
+
+    args = parser.parse_args()
+
+    main(args.inCsv, args.outParquet, args.rowGroupSize)
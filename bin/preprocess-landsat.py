@@ -0,0 +1,121 @@
+#! usr/bin/env/python
+
+import argparse
+import sys
+
+from giscode.common import CUTLINE, LANDSATDIR, PROCLSDIR
+from giscode.pipeline import findScenes, printSummary, processScenes
+from giscode.qa import POLICIES
+from giscode.raster import STORAGE
+
+
+def main(landsatDir, outDir, cutline, jobs, force, policy, storage, cog, verbose=False):
+    """
+    Reproject, re-scale, clip, cloud mask and resample all Landsat scenes in a
+    single process, writing only the final 100x100m rasters.
+
+    @param landsatDir: The C{str} directory containing one directory per
+        downloaded scene.
+    @param outDir: The C{str} directory that the final rasters will be written
+        to.
+    @param cutline: The C{str} filename of the shapefile to clip to.
+    @param jobs: The C{int} number of scenes to process in parallel.
+    @param force: If C{True}, rebuild all scenes, even those that are up to
+        date according to the build manifest.
+    @param policy: The C{str} name of the mask policy, see C{giscode.qa}.
+    @param storage: The C{str} storage profile of the final rasters, see
+        C{giscode.raster}.
+    @param cog: If C{True}, write a Cloud-Optimized GeoTIFF with overviews.
+    @param verbose: If C{True}, print the directory of each scene that is
+        processed.
+    @return: The C{int} number of scenes that failed.
+    """
+    results = processScenes(
+        findScenes(landsatDir),
+        outDir,
+        cutline,
+        jobs,
+        force,
+        policy,
+        storage,
+        cog,
+        verbose,
+    )
+
+    return printSummary(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="Preprocess landsat data.",
+    )
+
+    parser.add_argument(
+        "--landsatDir",
+        default=LANDSATDIR,
+        help="The directory containing the downloaded scenes.",
+    )
+
+    parser.add_argument(
+        "--outDir", default=PROCLSDIR, help="The directory for the output files."
+    )
+
+    parser.add_argument(
+        "--cutline", default=CUTLINE, help="The shapefile to clip the scenes to."
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="The number of scenes to process in parallel. Use 0 for one per CPU.",
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rebuild all scenes, even if their inputs did not change.",
+    )
+
+    parser.add_argument(
+        "--policy",
+        default="strict",
+        choices=tuple(POLICIES),
+        help="The mask policy that decides which pixels are usable.",
+    )
+
+    parser.add_argument(
+        "--storage",
+        default="float64",
+        choices=tuple(STORAGE),
+        help="The storage profile of the output file.",
+    )
+
+    parser.add_argument(
+        "--cog",
+        action="store_true",
+        help="Write a Cloud-Optimized GeoTIFF with overviews.",
+    )
+
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Print the directory of each scene that is processed.",
+    )
+
+    args = parser.parse_args()
+
+    failed = main(
+        args.landsatDir,
+        args.outDir,
+        args.cutline,
+        args.jobs,
+        args.force,
+        args.policy,
+        args.storage,
+        args.cog,
+        args.verbose,
+    )
+
+    sys.exit(1 if failed else 0)
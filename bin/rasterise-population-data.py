@@ -2,89 +2,65 @@
 
 
 import argparse
-import numpy as np
-import pandas as pd
-import rasterio
-from rasterio.transform import from_origin
 from rasterio import CRS
 
-from giscode.common import NODATAVAL
+from giscode.population import (
+    BANDS,
+    OLDCOLUMNS,
+    addOldColumns,
+    bandColumns,
+    bandScales,
+    rasterise,
+    readPopulation,
+    tableColumns,
+)
+from giscode.raster import STORAGE, writeRaster
 
 
-def main(inCsv, outRaster):
+def main(inTable, outRaster, storage="float64", cog=False, bands=BANDS, bbox=None):
     """
     Convert the population statistics dataset to raster. The population data
     CSV file has the filename 'BEVOELKERUNG_HA_P.csv' and was downloaded from
-    https://www.geolion.zh.ch/geodatensatz/show?gdsid=63.
+    https://www.geolion.zh.ch/geodatensatz/show?gdsid=63. Only the columns
+    that the bands need are read.
 
-    @param inCsv: The C{str} name of the input csv file.
+    @param inTable: The C{str} name of the input CSV file, or of a Parquet
+        file written by population-to-parquet.py.
     @param outRaster: The C{str} filename that the rescaled raster will be
         written to.
+    @param storage: The C{str} storage profile of the output, see
+        C{giscode.raster}. With integer profiles, bands with fractional
+        values, e.g. the fraction of people >65 years old, are stored in
+        hundredths.
+    @param cog: If C{True}, write a Cloud-Optimized GeoTIFF with overviews.
+    @param bands: A C{list} of C{str} band expressions, see
+        C{giscode.population}. The columns J_65PLUS_P and J_65PLUS_T
+        (percentage and number of people >65 years old) can be used too.
+    @param bbox: A C{tuple} (west, south, east, north) of the area whose
+        cells to rasterise, or C{None} for all cells.
     """
-    # Open the file
-    d = pd.read_csv(inCsv)
-
-    # Add another column that calculates total number of >65 year olds
-    d["J_65PLUS_T"] = d.apply(
-        lambda row: (
-            round((row["J_65_79_P"] + row["J_80PLUS_P"]) * row["PERS_N"] / 100, 0)
-            if row["PERS_N"] != NODATAVAL
-            else NODATAVAL
-        ),
-        axis=1,
-    )
-
-    # Add another column that summarises the fraction of people >65 years old
-    d["J_65PLUS_P"] = d.apply(
-        lambda row: (
-            row["J_65_79_P"] + row["J_80PLUS_P"] if row["PERS_N"] != NODATAVAL else NODATAVAL
-        ),
-        axis=1,
-    )
-
-    # Get extent
-    W = min(d["E"]) - 50
-    E = max(d["E"]) + 50
-    N = max(d["N"]) + 50
-    S = min(d["N"]) - 50
-
-    # Create arrays, suggested by ChatGPT
-    # Total number of people
-    total = np.full((int((N - S) / 100), int((E - W) / 100)), NODATAVAL)
-    # Total number of people >65 years old
-    totalOld = np.full((int((N - S) / 100), int((E - W) / 100)), NODATAVAL)
-    # Fraction of people >65 years old.
-    data = np.full((int((N - S) / 100), int((E - W) / 100)), NODATAVAL)
-
-    for i, row in d.iterrows():
-        wIndex = int((row["E"] - W) / 100)
-        sIndex = int((row["N"] - S) / 100)
-        total[268 - sIndex, wIndex] = float(row["PERS_N"])
-        totalOld[268 - sIndex, wIndex] = float(row["J_65PLUS_T"])
-        data[268 - sIndex, wIndex] = float(row["J_65PLUS_P"])
-
-    # Save array as raster dataset
-    new_dataset = rasterio.open(
+    d = readPopulation(inTable, bandColumns(bands, tableColumns(inTable)), bbox)
+    if set(OLDCOLUMNS) <= set(d):
+        addOldColumns(d)
+
+    # The grid is the smallest one that contains all hectare cells.
+    bands, transform = rasterise(d, bands)
+
+    # Save array as raster dataset, one band per expression, described by its
+    # name. By default band 1 is the fraction of people >65 years old, band 2
+    # is the total number of people >65 years old and band 3 is the total
+    # number of people.
+    writeRaster(
         outRaster,
-        "w",
-        driver="GTiff",
-        height=data.shape[0],
-        width=data.shape[1],
-        count=3,
-        dtype=str(data.dtype),
-        crs=CRS.from_epsg(2056),
-        nodata=NODATAVAL,
-        transform=from_origin(W, N, 100, 100),
+        list(bands.values()),
+        CRS.from_epsg(2056),
+        transform,
+        storage,
+        scales=bandScales(list(bands.values())),
+        descriptions=list(bands),
+        cog=cog,
     )
 
-    # Add different bands to the raster data. Band 1 is the fraction of people
-    # >65 years old, band 2 is the total number of people >65 years old, band
-    # 3 is the total number of people.
-    new_dataset.write(data, 1)
-    new_dataset.write(totalOld, 2)
-    new_dataset.write(total, 3)
-    new_dataset.close()
-
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -92,10 +68,54 @@ if __name__ == "__main__":
         description="Rasterise the population dataset.",
     )
 
-    parser.add_argument("--inCsv", help="The name of the input CSV file.")
+    parser.add_argument(
+        "--inTable",
+        "--inCsv",
+        dest="inTable",
+        help="The name of the input CSV or Parquet (.parquet) file.",
+    )
 
     parser.add_argument("--outRaster", help="The name of the output file.")
 
+    parser.add_argument(
+        "--storage",
+        default="float64",
+        choices=tuple(STORAGE),
+        help="The storage profile of the output file, e.g. uint16.",
+    )
+
+    parser.add_argument(
+        "--cog",
+        action="store_true",
+        help="Write a Cloud-Optimized GeoTIFF with overviews.",
+    )
+
+    parser.add_argument(
+        "--band",
+        action="append",
+        dest="bands",
+        help=(
+            "A band to write, either a CSV column such as DICHTE_PHA or "
+            "'name=expression' such as 'J_0_15_P=J_0_6_P + J_7_15_P'. May be "
+            f"repeated. Defaults to {' '.join(BANDS)}."
+        ),
+    )
+
+    parser.add_argument(
+        "--bbox",
+        nargs=4,
+        type=float,
+        metavar=("WEST", "SOUTH", "EAST", "NORTH"),
+        help="Only rasterise the cells whose centre is in this area.",
+    )
+
     args = parser.parse_args()
 
-    main(args.inCsv, args.outRaster)
+    main(
+        args.inTable,
+        args.outRaster,
+        args.storage,
+        args.cog,
+        args.bands or BANDS,
+        args.bbox,
+    )
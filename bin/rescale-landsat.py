@@ -5,9 +5,11 @@ import argparse
 import rasterio
 
 from giscode.common import NODATAVAL
+from giscode.landsat import toCelsius
+from giscode.raster import STORAGE, processBlocks, writeRaster
 
 
-def main(inRaster, outRaster):
+def main(inRaster, outRaster, blocks=False, storage="float64", cog=False):
     """
     Re-scale the input raster file. The input raster file must be a Landsat 8
     or 9 Collection 2 Level 2 Science product containing surface temperature
@@ -19,22 +21,15 @@ def main(inRaster, outRaster):
         9 file containint Surface Temperature information ending in *_B10.TIF.
     @param outRaster: The C{str} filename that the rescaled raster will be
         written to.
+    @param blocks: If C{True}, stream the raster block by block, so that
+        memory use is bounded by the block size instead of the raster size.
+    @param storage: The C{str} storage profile of the output, see
+        C{giscode.raster}.
+    @param cog: If C{True}, write a Cloud-Optimized GeoTIFF with overviews.
     """
     # Open the file
     raster = rasterio.open(inRaster)
-    b10Data = raster.read(1)
 
-    # Scale the surface temperature
-    b10DataRescaled = (b10Data * 0.00341802) + 149
-
-    # The no-data value is 0. If we convert to Celsius, some of the data may
-    # be below 0, therefore we need to change the no-data value.
-    b10DataRescaled[b10DataRescaled == 0] = NODATAVAL + 273.15
-
-    # Convert to Celsius
-    b10DataCelsius = b10DataRescaled - 273.15
-
-    # Write the output file
     kwargs = raster.meta.copy()
     kwargs.update(
         {
@@ -49,10 +44,24 @@ def main(inRaster, outRaster):
         }
     )
 
-    with rasterio.open(fp=outRaster, mode="w", **kwargs) as dst:
-        dst.write(b10DataCelsius, 1)
-
-    raster.close()
+    # Scale the surface temperature and convert to Celsius. The no-data value
+    # is 0. As some of the data may be below 0 Celsius, no-data pixels are set
+    # to NODATAVAL.
+    if blocks:
+        raster.close()
+        processBlocks([inRaster], outRaster, kwargs, toCelsius, storage, cog=cog)
+    else:
+        b10DataCelsius = toCelsius(raster.read(1))
+        raster.close()
+
+        writeRaster(
+            outRaster,
+            [b10DataCelsius],
+            raster.crs,
+            raster.transform,
+            storage,
+            cog=cog,
+        )
 
 
 if __name__ == "__main__":
@@ -67,6 +76,25 @@ if __name__ == "__main__":
 
     parser.add_argument("--outRaster", help="The name of the output file.")
 
+    parser.add_argument(
+        "--blocks",
+        action="store_true",
+        help="Process the raster block by block to bound memory use.",
+    )
+
+    parser.add_argument(
+        "--storage",
+        default="float64",
+        choices=tuple(STORAGE),
+        help="The storage profile of the output file.",
+    )
+
+    parser.add_argument(
+        "--cog",
+        action="store_true",
+        help="Write a Cloud-Optimized GeoTIFF with overviews.",
+    )
+
     args = parser.parse_args()
 
-    main(args.inRaster, args.outRaster)
+    main(args.inRaster, args.outRaster, args.blocks, args.storage, args.cog)
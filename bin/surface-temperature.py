@@ -0,0 +1,130 @@
+#! usr/bin/env/python
+
+
+import argparse
+from functools import partial
+
+import rasterio
+
+from giscode.common import NODATAVAL
+from giscode.landsat import availableBackends, surfaceTemperature
+from giscode.qa import POLICIES
+from giscode.raster import STORAGE, processBlocks, writeRaster
+
+
+def main(inRaster, qaRaster, outRaster, storage, backend, blocks, policy, cog):
+    """
+    Compute the cloud masked surface temperature in Celsius from the raw
+    surface temperature and QA_PIXEL bands in a single pass. This does the
+    same as running rescale-landsat.py and mask-clouds.py one after the
+    other, without writing the intermediate raster.
+
+    @param inRaster: The C{str} name of the input file. Must be a Landsat 8 or
+        9 file containing Surface Temperature information ending in *_B10.TIF.
+    @param qaRaster: The C{str} name of the QA_PIXEL file on the same grid as
+        C{inRaster}, or C{None} to derive it from C{inRaster}.
+    @param outRaster: The C{str} filename that the masked raster will be
+        written to.
+    @param storage: The C{str} storage profile of the output, see
+        C{giscode.raster}.
+    @param backend: The C{str} name of the backend of the kernel.
+    @param blocks: If C{True}, stream the rasters block by block, so that
+        memory use is bounded by the block size instead of the raster size.
+    @param policy: The C{str} name of the mask policy that decides which
+        pixels are usable, see C{giscode.qa}.
+    @param cog: If C{True}, write a Cloud-Optimized GeoTIFF with overviews.
+    """
+    if qaRaster is None:
+        qaRaster = inRaster.replace("_ST_B10", "_QA_PIXEL")
+
+    kernel = partial(surfaceTemperature, backend=backend, policy=policy)
+
+    with rasterio.open(inRaster) as raster:
+        kwargs = raster.meta.copy()
+        kwargs.update({"count": 1, "nodata": NODATAVAL})
+
+        if not blocks:
+            with rasterio.open(qaRaster) as qa:
+                celsius = kernel(raster.read(1), qa.read(1))
+
+    if blocks:
+        processBlocks([inRaster, qaRaster], outRaster, kwargs, kernel, storage, cog=cog)
+    else:
+        writeRaster(
+            outRaster,
+            [celsius],
+            kwargs["crs"],
+            kwargs["transform"],
+            storage,
+            cog=cog,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description=(
+            "Re-scale landsat B10 band, convert to Celsius and mask clouds in "
+            "a single pass."
+        ),
+    )
+
+    parser.add_argument(
+        "--inRaster", help="The name of the input file. Must end in *_B10.TIF."
+    )
+
+    parser.add_argument(
+        "--qaRaster",
+        help=(
+            "The name of the QA_PIXEL file. Defaults to the input file name "
+            "with _ST_B10 replaced by _QA_PIXEL."
+        ),
+    )
+
+    parser.add_argument("--outRaster", help="The name of the output file.")
+
+    parser.add_argument(
+        "--storage",
+        default="float64",
+        choices=tuple(STORAGE),
+        help="The storage profile of the output file.",
+    )
+
+    parser.add_argument(
+        "--backend",
+        default="auto",
+        choices=["auto"] + availableBackends(),
+        help="The backend used to compute the temperature.",
+    )
+
+    parser.add_argument(
+        "--blocks",
+        action="store_true",
+        help="Process the rasters block by block to bound memory use.",
+    )
+
+    parser.add_argument(
+        "--policy",
+        default="strict",
+        choices=tuple(POLICIES),
+        help="The mask policy that decides which pixels are usable.",
+    )
+
+    parser.add_argument(
+        "--cog",
+        action="store_true",
+        help="Write a Cloud-Optimized GeoTIFF with overviews.",
+    )
+
+    args = parser.parse_args()
+
+    main(
+        args.inRaster,
+        args.qaRaster,
+        args.outRaster,
+        args.storage,
+        args.backend,
+        args.blocks,
+        args.policy,
+        args.cog,
+    )
@@ -4,9 +4,20 @@ import giscode
 
 TOPDIR = dirname(dirname(giscode.__file__))
 
-PROCLSDIR = join(TOPDIR, 'data', 'landsat', 'resolution')
+LANDSATDIR = join(TOPDIR, 'data', 'landsat')
+PROCLSDIR = join(LANDSATDIR, 'resolution')
 BEVDIR = join('data', 'bevoelkerungsstatistik',
               'Raumliche_Bevolkerungsstatistik_-OGD')
+CUTLINE = join(TOPDIR, 'data', 'gemeindegrenzen',
+               'UP_GEMEINDEN_OHNE_SEEN_F.shp')
+
+# All rasters are reprojected to CH1903+ / LV95.
+CRS = 'EPSG:2056'
+
+# The 100x100m grid (west, south, east, north) that the remote sensing data
+# is resampled to, so that it matches the population data.
+GRIDBOUNDS = (2674600, 1237800, 2695100, 1258100)
+GRIDRES = 100
 
 GOODSCENES = (
     join(PROCLSDIR,
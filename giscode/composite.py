@@ -0,0 +1,271 @@
+"""
+Combine several scenes on the same grid into per-pixel composites (mean,
+maximum, percentiles, ...). Missing pixels in a scene are ignored.
+
+Reducers that can be computed with running accumulators ('count', 'mean',
+'min', 'max', 'variance' and 'std') are computed in a single pass that reads
+one scene at a time, so memory use does not depend on the number of scenes.
+Order statistics ('median' and percentiles such as 'p90') need all values of
+a pixel at once. For these, the scenes are read in chunks of rows and the
+chunks are stacked, so memory use is bounded by the chunk size.
+"""
+
+import re
+import warnings
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from giscode.common import NODATAVAL
+from giscode.raster import readBand
+
+RUNNING = ("count", "mean", "min", "max", "variance", "std")
+PERCENTILE = re.compile(r"p(\d+(\.\d+)?)$")
+
+
+def percentile(reducer):
+    """
+    Get the percentile an order statistic reducer stands for.
+
+    @param reducer: The C{str} name of a reducer.
+    @return: The C{float} percentile for 'median' and 'pNN' reducers, else
+        C{None}.
+    """
+    if reducer == "median":
+        return 50.0
+
+    match = PERCENTILE.match(reducer)
+    if match:
+        return float(match.group(1))
+
+
+def checkReducers(reducers):
+    """
+    Check that reducer names are valid.
+
+    @param reducers: An iterable of C{str} reducer names.
+    @raise ValueError: If a name is not valid.
+    """
+    for reducer in reducers:
+        if reducer not in RUNNING:
+            q = percentile(reducer)
+            if q is None or not 0 <= q <= 100:
+                raise ValueError(
+                    f"Unknown reducer {reducer!r}. Use one of "
+                    f"{', '.join(RUNNING)}, 'median' or a percentile such as "
+                    f"'p90'."
+                )
+
+
+class RunningStats:
+    """
+    Per-pixel running count, mean, variance, minimum and maximum. The mean
+    and variance are updated with Welford's algorithm, which is numerically
+    stable.
+
+    @param shape: The C{(height, width)} shape of the grid.
+    """
+
+    def __init__(self, shape):
+        self.count = np.zeros(shape, dtype="int64")
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+
+    def update(self, data):
+        """
+        Add a scene.
+
+        @param data: A C{np.ndarray} of C{float64} with NaN for missing
+            pixels.
+        """
+        valid = ~np.isnan(data)
+        value = data[valid]
+
+        self.count[valid] += 1
+        delta = value - self.mean[valid]
+        self.mean[valid] += delta / self.count[valid]
+        self.m2[valid] += delta * (value - self.mean[valid])
+        np.fmin(self.min, data, out=self.min)
+        np.fmax(self.max, data, out=self.max)
+
+    def result(self, reducer):
+        """
+        Get a composite.
+
+        @param reducer: The C{str} name of a reducer in C{RUNNING}.
+        @return: A C{np.ndarray} with NaN for pixels without data ('count' is
+            0 there instead).
+        """
+        if reducer == "count":
+            return self.count.astype("float64")
+
+        empty = self.count == 0
+        if reducer == "mean":
+            result = self.mean.copy()
+        elif reducer == "min":
+            result = self.min.copy()
+        elif reducer == "max":
+            result = self.max.copy()
+        else:
+            # Population variance, like np.var.
+            with np.errstate(invalid="ignore", divide="ignore"):
+                result = self.m2 / self.count
+            if reducer == "std":
+                result = np.sqrt(result)
+
+        result[empty] = np.nan
+        return result
+
+
+def gridOf(filenames):
+    """
+    Get the grid shared by several rasters.
+
+    @param filenames: A C{list} of C{str} raster filenames.
+    @raise ValueError: If the rasters are not all on the same grid.
+    @return: A C{tuple} of the C{(height, width)} shape, the C{Affine}
+        transform and the CRS.
+    """
+    grid = None
+    for filename in filenames:
+        with rasterio.open(filename) as src:
+            this = (src.shape, src.transform, src.crs)
+        if grid is None:
+            grid = this
+        elif this != grid:
+            raise ValueError(f"{filename} is not on the same grid as {filenames[0]}.")
+
+    return grid
+
+
+def readScene(src, window=None):
+    """
+    Read a scene with NaN for missing pixels.
+
+    @param src: An open rasterio dataset.
+    @param window: A C{Window} to read, or C{None} to read the whole band.
+    @return: A C{np.ndarray} of C{float64}.
+    """
+    data = readBand(src, 1, window)
+    data[data == NODATAVAL] = np.nan
+    return data
+
+
+def reduceScenes(shape, reducers, scenes, rows, chunkRows=64):
+    """
+    Compute per-pixel composites from any source of scenes.
+
+    @param shape: The C{(height, width)} shape of the grid.
+    @param reducers: A C{list} of C{str} reducer names, see the module
+        docstring.
+    @param scenes: A function that returns an iterator over the scenes, each
+        a 2D C{np.ndarray} with NaN for missing pixels. Only called for
+        running reducers.
+    @param rows: A function that is called with the C{int} first and last
+        (exclusive) row of a chunk and returns a 3D C{np.ndarray} of shape
+        (scene, row, col) with NaN for missing pixels. Only called for order
+        statistics.
+    @param chunkRows: The C{int} number of rows read at once for order
+        statistics.
+    @return: A C{dict} mapping each reducer name to a C{np.ndarray} of
+        C{float64} with NaN for pixels without data.
+    """
+    checkReducers(reducers)
+    results = {}
+
+    running = [reducer for reducer in reducers if reducer in RUNNING]
+    if running:
+        stats = RunningStats(shape)
+        for data in scenes():
+            stats.update(np.asarray(data, dtype="float64"))
+        for reducer in running:
+            results[reducer] = stats.result(reducer)
+
+    ordered = [reducer for reducer in reducers if reducer not in RUNNING]
+    if ordered:
+        qs = [percentile(reducer) for reducer in ordered]
+        for reducer in ordered:
+            results[reducer] = np.full(shape, np.nan)
+
+        for start in range(0, shape[0], chunkRows):
+            stop = min(start + chunkRows, shape[0])
+            stack = np.asarray(rows(start, stop), dtype="float64")
+            with warnings.catch_warnings():
+                # All-NaN pixels give NaN, which is what we want.
+                warnings.simplefilter("ignore", RuntimeWarning)
+                values = np.nanpercentile(stack, qs, axis=0)
+            for reducer, value in zip(ordered, values):
+                results[reducer][start:stop] = value
+
+    return {reducer: results[reducer] for reducer in reducers}
+
+
+def composite(filenames, reducers=("mean",), chunkRows=64):
+    """
+    Compute per-pixel composites of several scenes.
+
+    @param filenames: A C{list} of C{str} filenames of single band rasters on
+        the same grid.
+    @param reducers: An iterable of C{str} reducer names, see the module
+        docstring.
+    @param chunkRows: The C{int} number of rows read at once for order
+        statistics.
+    @raise ValueError: If a reducer is unknown, no filenames are given or the
+        rasters are not on the same grid.
+    @return: A C{tuple} of a C{dict} mapping each reducer name to a
+        C{np.ndarray} with NaN for pixels without data, the C{Affine}
+        transform and the CRS of the grid.
+    """
+    reducers = list(reducers)
+    checkReducers(reducers)
+    if not filenames:
+        raise ValueError("No scenes to composite.")
+
+    shape, transform, crs = gridOf(filenames)
+
+    def scenes():
+        for filename in filenames:
+            with rasterio.open(filename) as src:
+                yield readScene(src)
+
+    srcs = []
+
+    def rows(start, stop):
+        if not srcs:
+            srcs.extend(rasterio.open(filename) for filename in filenames)
+        window = Window(0, start, shape[1], stop - start)
+        return np.stack([readScene(src, window) for src in srcs])
+
+    try:
+        results = reduceScenes(shape, reducers, scenes, rows, chunkRows)
+    finally:
+        for src in srcs:
+            src.close()
+
+    return results, transform, crs
+
+
+def compositeCube(cube, reducers=("mean",), chunkRows=64):
+    """
+    Compute per-pixel composites of the scenes in a cube. The scenes are read
+    from the memory mapped array, without opening any rasters.
+
+    @param cube: A C{giscode.cube.Cube}.
+    @param reducers: An iterable of C{str} reducer names, see the module
+        docstring.
+    @param chunkRows: The C{int} number of rows read at once for order
+        statistics.
+    @raise ValueError: If a reducer is unknown.
+    @return: A C{tuple} like the one returned by C{composite}.
+    """
+    results = reduceScenes(
+        cube.shape,
+        list(reducers),
+        lambda: iter(cube.data),
+        lambda start, stop: cube.data[:, start:stop],
+        chunkRows,
+    )
+    return results, cube.transform, cube.crs
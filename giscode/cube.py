@@ -0,0 +1,222 @@
+"""
+A scene cube: the preprocessed 100m scenes packed into a single C{float32}
+array of shape (time, row, col), stored as a .npy file, with a JSON index of
+the dates, sensors and files of the scenes and the grid they are on. The
+files are stored relative to the directory of the cube, so a cube stays valid
+when the repository is moved.
+
+The array is memory mapped when a cube is opened, so reading a scene or the
+time series of a pixel is a slice of the mapped file instead of opening every
+GeoTIFF. Missing pixels are NaN.
+"""
+
+import json
+import os
+from os.path import abspath, basename, dirname, exists, join, normpath, relpath
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.transform import rowcol
+
+from giscode.common import GOODSCENES, PROCLSDIR
+from giscode.composite import gridOf, readScene
+from giscode.manifest import fileHash
+
+# The default cube, made from GOODSCENES. The array is CUBE + '.npy' and the
+# index CUBE + '.json'.
+CUBE = join(PROCLSDIR, "cube")
+
+
+def sceneInfo(filename):
+    """
+    Get the acquisition date, sensor and WRS path and row of a scene from its
+    Landsat product name, e.g. LC08_L2SP_194027_20220623_20220705_02_T1.
+
+    @param filename: The C{str} filename of the scene.
+    @return: A C{dict} with 'date' (YYYYMMDD), 'sensor' (e.g. 'LC08'),
+        'wrsPath' and 'wrsRow'.
+    """
+    fields = basename(filename).split("_")
+    return {
+        "date": fields[3],
+        "sensor": fields[0],
+        "wrsPath": int(fields[2][:3]),
+        "wrsRow": int(fields[2][3:]),
+    }
+
+
+def _paths(base):
+    return base + ".npy", base + ".json"
+
+
+def _resolve(base, filename):
+    # The absolute path of a file stored relative to the directory of a cube.
+    # Absolute paths, as stored by older cubes, are kept.
+    return normpath(join(dirname(abspath(base)), filename))
+
+
+def isUpToDate(base, filenames):
+    """
+    Check whether a cube was built from exactly the given files, with the same
+    content.
+
+    @param base: The C{str} filename of the cube without extension.
+    @param filenames: A C{list} of C{str} scene filenames.
+    @return: C{True} if the cube exists and does not need to be rebuilt.
+    """
+    npy, index = _paths(base)
+    if not (exists(npy) and exists(index)):
+        return False
+
+    with open(index) as fp:
+        index = json.load(fp)
+
+    filenames = [normpath(abspath(filename)) for filename in filenames]
+    cache = {
+        _resolve(base, filename): cached
+        for filename, cached in index.get("hashes", {}).items()
+    }
+    stored = [_resolve(base, scene["file"]) for scene in index["scenes"]]
+    hashes = [scene["sha256"] for scene in index["scenes"]]
+    return stored == filenames and hashes == [
+        fileHash(filename, cache) for filename in filenames
+    ]
+
+
+def buildCube(filenames=GOODSCENES, base=CUBE, force=False):
+    """
+    Pack scenes into a cube. The scenes are read one at a time and written
+    straight to the memory mapped array.
+
+    @param filenames: A C{list} of C{str} filenames of single band rasters on
+        the same grid. The scenes are stored in this order.
+    @param base: The C{str} filename of the cube without extension.
+    @param force: If C{True}, rebuild the cube even if it is up to date.
+    @raise ValueError: If no filenames are given or the rasters are not on the
+        same grid.
+    @return: The C{Cube}.
+    """
+    filenames = list(filenames)
+    if not filenames:
+        raise ValueError("No scenes to put into the cube.")
+
+    if not force and isUpToDate(base, filenames):
+        return Cube(base)
+
+    (height, width), transform, crs = gridOf(filenames)
+    npy, index = _paths(base)
+
+    # Write to temporary files first, so an interrupted build doesn't leave a
+    # cube behind that looks complete.
+    tmp = base + ".tmp.npy"
+    data = np.lib.format.open_memmap(
+        tmp, mode="w+", dtype="float32", shape=(len(filenames), height, width)
+    )
+    directory = dirname(abspath(base))
+    hashes = {}
+    scenes = []
+    for i, filename in enumerate(filenames):
+        with rasterio.open(filename) as src:
+            data[i] = readScene(src)
+        stored = relpath(abspath(filename), directory)
+        scenes.append(dict(sceneInfo(filename), file=stored))
+        scenes[-1]["sha256"] = fileHash(filename, hashes)
+        hashes[stored] = hashes.pop(filename)
+    data.flush()
+    del data
+    os.replace(tmp, npy)
+
+    with open(index + ".tmp", "w") as fp:
+        json.dump(
+            {
+                "scenes": scenes,
+                "crs": crs.to_string(),
+                "transform": list(transform)[:6],
+                "shape": [len(filenames), height, width],
+                "hashes": hashes,
+            },
+            fp,
+            indent=1,
+        )
+    os.replace(index + ".tmp", index)
+
+    return Cube(base)
+
+
+def getCube(filenames=GOODSCENES, base=CUBE):
+    """
+    Open a cube, building or rebuilding it first if it is missing or was made
+    from other files.
+
+    @param filenames: A C{list} of C{str} scene filenames.
+    @param base: The C{str} filename of the cube without extension.
+    @return: The C{Cube}.
+    """
+    return buildCube(filenames, base)
+
+
+class Cube:
+    """
+    A read-only, memory mapped scene cube.
+
+    @param base: The C{str} filename of the cube without extension.
+    """
+
+    def __init__(self, base=CUBE):
+        npy, index = _paths(base)
+        with open(index) as fp:
+            self.index = json.load(fp)
+
+        self.data = np.load(npy, mmap_mode="r")
+        self.scenes = self.index["scenes"]
+        self.dates = [scene["date"] for scene in self.scenes]
+        self.sensors = [scene["sensor"] for scene in self.scenes]
+        self.files = [_resolve(base, scene["file"]) for scene in self.scenes]
+        self.transform = Affine(*self.index["transform"])
+        self.crs = CRS.from_string(self.index["crs"])
+
+    def __len__(self):
+        return len(self.scenes)
+
+    @property
+    def shape(self):
+        """
+        The C{(height, width)} shape of the grid.
+        """
+        return self.data.shape[1:]
+
+    def scene(self, date):
+        """
+        Get a scene.
+
+        @param date: The C{str} acquisition date (YYYYMMDD) of the scene.
+        @raise KeyError: If there is no scene of that date in the cube.
+        @return: A read-only 2D C{np.ndarray} view of the scene.
+        """
+        try:
+            return self.data[self.dates.index(date)]
+        except ValueError:
+            raise KeyError(f"No scene of {date} in the cube.") from None
+
+    def timeseries(self, row, col):
+        """
+        Get the time series of a pixel.
+
+        @param row: The C{int} row of the pixel.
+        @param col: The C{int} column of the pixel.
+        @return: A 1D C{np.ndarray} with one value per scene.
+        """
+        return self.data[:, row, col]
+
+    def at(self, x, y):
+        """
+        Get the time series of the pixel that contains a point.
+
+        @param x: The C{float} x coordinate in the CRS of the cube.
+        @param y: The C{float} y coordinate in the CRS of the cube.
+        @return: A 1D C{np.ndarray} with one value per scene.
+        """
+        row, col = rowcol(self.transform, x, y)
+        return self.timeseries(row, col)
@@ -0,0 +1,141 @@
+"""
+Helpers for the cells of a regular raster grid, such as their geometries and
+the spatial weights between them. Cells are numbered in row-major order, like
+the elements of a flattened band.
+"""
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+from scipy.sparse import csr_array
+
+
+def cornerLattice(transform, shape, crs=None, dstCrs=None):
+    """
+    Compute the coordinates of all cell corners of a grid, optionally in
+    another CRS. Neighbouring cells share corners, so each corner is only
+    transformed once.
+
+    @param transform: The C{Affine} transform of a north-up grid.
+    @param shape: The C{(height, width)} shape of the grid.
+    @param crs: The CRS of the grid, anything C{pyproj} accepts.
+    @param dstCrs: The CRS to transform the corners to, or C{None} to keep
+        them in the CRS of the grid.
+    @return: A C{tuple} of C{np.ndarray}s of shape C{(height + 1, width + 1)}
+        with the x (longitude) and y (latitude) coordinates of the corners.
+        Corner (row, col) is the north-west corner of cell (row, col).
+    """
+    height, width = shape
+    rows, cols = np.indices((height + 1, width + 1))
+    x = transform.c + cols * transform.a
+    y = transform.f + rows * transform.e
+
+    if dstCrs is not None:
+        x, y = Transformer.from_crs(crs, dstCrs, always_xy=True).transform(x, y)
+
+    return x, y
+
+
+def latticePolygons(lattice, rows, cols):
+    """
+    Make the polygons of grid cells from the corner lattice of the grid. The
+    polygons are exactly watertight, because neighbouring cells use the same
+    corners.
+
+    @param lattice: A C{tuple} with the x and y coordinates of the corners of
+        the grid, as returned by C{cornerLattice}.
+    @param rows: A C{np.ndarray} with the row of every cell.
+    @param cols: A C{np.ndarray} with the column of every cell.
+    @return: A C{np.ndarray} of shapely C{Polygon}s.
+    """
+    x, y = lattice
+    # Counter-clockwise rings: south-west, south-east, north-east, north-west
+    # and back to south-west.
+    ringRows = np.asarray(rows)[:, None] + np.array([1, 1, 0, 0, 1])
+    ringCols = np.asarray(cols)[:, None] + np.array([0, 1, 1, 0, 0])
+    rings = np.stack([x[ringRows, ringCols], y[ringRows, ringCols]], axis=-1)
+
+    return shapely.polygons(rings)
+
+
+def neighbourOffsets(kind="queen", order=1):
+    """
+    Get the row and column offsets of the neighbours of a cell.
+
+    @param kind: The C{str} kind of contiguity: 'queen' (cells that share an
+        edge or a corner, extended to the k-ring of cells at most C{order}
+        cells away) or 'rook' (cells that share an edge, extended to cells at
+        most C{order} steps along rows and columns away).
+    @param order: The C{int} order of the contiguity. The first order queen
+        neighbours are the 8 surrounding cells.
+    @raise ValueError: If C{kind} is unknown or C{order} is < 1.
+    @return: A C{list} of C{(row, col)} offsets, without C{(0, 0)}.
+    """
+    if kind not in ("queen", "rook"):
+        raise ValueError(f"Unknown contiguity {kind!r}. Use 'queen' or 'rook'.")
+    if order < 1:
+        raise ValueError(f"The order must be at least 1, not {order}.")
+
+    return [
+        (dr, dc)
+        for dr in range(-order, order + 1)
+        for dc in range(-order, order + 1)
+        if (dr, dc) != (0, 0) and (kind == "queen" or abs(dr) + abs(dc) <= order)
+    ]
+
+
+def latticeWeights(
+    mask, kind="queen", order=1, includeSelf=False, rowStandardise=False
+):
+    """
+    Build spatial weights for the cells of a grid directly from their rows and
+    columns, instead of searching for nearest neighbours. Cells without data
+    are neither weighted nor neighbours.
+
+    @param mask: A C{bool} C{np.ndarray} that is C{True} for the cells with
+        data. The cells are numbered in row-major order of the C{True} cells,
+        so row i of the weights belongs to C{np.flatnonzero(mask)[i]}.
+    @param kind: The C{str} kind of contiguity, see C{neighbourOffsets}.
+    @param order: The C{int} order of the contiguity.
+    @param includeSelf: If C{True}, every cell is its own neighbour with
+        weight 1, as used by the Getis-Ord Gi* statistic.
+    @param rowStandardise: If C{True}, the weights of each row sum to 1.
+    @raise ValueError: If C{kind} is unknown or C{order} is < 1.
+    @return: A C{scipy.sparse.csr_array} of shape (n, n), with n the number
+        of cells with data.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    height, width = mask.shape
+    rows, cols = np.nonzero(mask)
+    n = len(rows)
+    ids = np.full(mask.shape, -1, dtype="int64")
+    ids[rows, cols] = np.arange(n)
+
+    offsets = neighbourOffsets(kind, order)
+    if includeSelf:
+        offsets.append((0, 0))
+
+    i, j = [], []
+    for dr, dc in offsets:
+        neighbourRows = rows + dr
+        neighbourCols = cols + dc
+        inside = (
+            (neighbourRows >= 0)
+            & (neighbourRows < height)
+            & (neighbourCols >= 0)
+            & (neighbourCols < width)
+        )
+        neighbours = np.full(n, -1, dtype="int64")
+        neighbours[inside] = ids[neighbourRows[inside], neighbourCols[inside]]
+        found = neighbours >= 0
+        i.append(np.flatnonzero(found))
+        j.append(neighbours[found])
+
+    i = np.concatenate(i)
+    j = np.concatenate(j)
+    weights = np.ones(len(i))
+    if rowStandardise:
+        counts = np.bincount(i, minlength=n)
+        weights /= counts[i]
+
+    return csr_array((weights, (i, j)), shape=(n, n))
@@ -0,0 +1,296 @@
+"""
+Find hot and cold spots with the Getis-Ord Gi* statistic.
+
+The z-scores are computed in closed form (Getis & Ord 1995, Ord & Getis
+1995) with one sparse matrix-vector product, and p-values either from the
+normal distribution or by conditional permutation, like C{esda}. Weights are
+a C{scipy.sparse} matrix that includes the self weights on its diagonal, e.g.
+from C{giscode.grid.latticeWeights(mask, includeSelf=True)}.
+
+The variance of the z-scores is that of the actual weights, so the z-scores
+and p-values do not change if the weights are row standardised. This differs
+from C{esda.G_Local(star=True)} with row-standardised weights (transform
+'R'), which computes the variance as if the weights were binary. Its z-scores
+are therefore smaller, and not on the same scale as these.
+
+Several variables can be analysed at once by passing a matrix with one column
+per variable. Missing values (NaN) are left out of the analysis of their
+variable, as if the cell and its weights were not there.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.special import ndtr
+
+# Ways to correct p-values for testing many cells at once.
+CORRECTIONS = ("none", "bonferroni", "fdr")
+
+# The classes of cells: significantly high (hot spot) or low (cold spot)
+# values, or not significant.
+HOT, COLD, NOTSIGNIFICANT = "pos", "neg", "ns"
+
+
+def giStar(y, weights):
+    """
+    Compute the Gi* z-scores of all cells. With several variables, the same
+    weights are used for all of them in three sparse matrix products.
+
+    @param y: A C{np.ndarray} with the value of each cell, either 1D or 2D
+        with one column per variable, with NaN for missing values.
+    @param weights: A C{scipy.sparse} matrix of shape (n, n) with the weights
+        between the cells, including the self weights.
+    @return: A C{np.ndarray} of z-scores of the shape of C{y}. Cells for which
+        the z-score is not defined (missing values, or e.g. if all values are
+        the same) get NaN.
+    """
+    y = np.asarray(y, dtype="float64")
+    weights = weights.tocsr()
+
+    present = ~np.isnan(y)
+    values = np.where(present, y, 0)
+    n = present.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = values.sum(axis=0) / n
+        std = np.sqrt((values**2).sum(axis=0) / n - mean**2)
+
+    # The sums of the weights of the neighbours with values, per variable.
+    mask = present.astype("float64")
+    lag = weights @ values
+    wSum = weights @ mask
+    w2Sum = weights.multiply(weights) @ mask
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = (lag - mean * wSum) / (std * np.sqrt((n * w2Sum - wSum**2) / (n - 1)))
+    z[~np.isfinite(z) | ~present] = np.nan
+    return z
+
+
+def analyticPValues(z):
+    """
+    Compute two-sided p-values of z-scores from the normal distribution.
+
+    @param z: A C{np.ndarray} of z-scores.
+    @return: A C{np.ndarray} of p-values, NaN where C{z} is NaN.
+    """
+    return 2 * ndtr(-np.abs(z))
+
+
+def _drawNeighbours(rng, cells, n, permutations, k):
+    # Draw k distinct other cells for every cell and permutation. Draws are
+    # made from the n - 1 cells other than the cell itself, and draws with a
+    # repeated cell are redrawn, which is rare if k is much smaller than n.
+    draws = rng.integers(0, n - 1, size=(len(cells) * permutations, k), dtype="int32")
+    check = draws
+    rows = slice(None)
+    while k > 1:
+        ordered = np.sort(check, axis=1)
+        rows = np.arange(len(draws))[rows][
+            (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+        ]
+        if not len(rows):
+            break
+        check = draws[rows] = rng.integers(0, n - 1, size=(len(rows), k), dtype="int32")
+    draws = draws.reshape(len(cells), permutations, k)
+    draws += draws >= cells[:, None, None]
+    return draws
+
+
+def _permuteChunk(
+    y, cells, observed, selfWeights, neighbourWeights, permutations, seed
+):
+    # Count, for every cell, the permutations whose statistic is at least as
+    # extreme as the observed one, in the direction of the observed one.
+    rng = np.random.default_rng(seed)
+    k = neighbourWeights.shape[1]
+    draws = _drawNeighbours(rng, cells, len(y), permutations, k)
+    simulated = np.einsum("cpk,ck->cp", y[draws], neighbourWeights)
+    simulated += (selfWeights * y[cells])[:, None]
+    above = (simulated >= observed[:, None]).sum(axis=1)
+    return np.minimum(above, permutations - above)
+
+
+def permutationPValues(
+    y, weights, permutations=999, seed=12345, jobs=1, chunkSize=1024
+):
+    """
+    Compute pseudo p-values of the Gi* statistic by conditional permutation.
+    For every cell, the values of its neighbours are replaced by randomly
+    drawn values of other cells, keeping its own value. The p-value is the
+    share of permutations whose statistic is at least as extreme as the
+    observed one in the direction of the observed one, like C{esda}'s
+    C{p_sim}.
+
+    Cells are processed in chunks with their own random streams derived from
+    C{seed}, so the result does not depend on the number of jobs.
+
+    @param y: A 1D C{np.ndarray} with the value of each cell, without missing
+        values.
+    @param weights: A C{scipy.sparse} matrix of shape (n, n) with the weights
+        between the cells, including the self weights.
+    @param permutations: The C{int} number of permutations.
+    @param seed: The C{int} seed of the random numbers.
+    @param jobs: The C{int} number of processes to use. Use 0 for one per
+        CPU.
+    @param chunkSize: The C{int} maximum number of cells per chunk.
+    @return: A C{np.ndarray} of pseudo p-values.
+    """
+    y = np.asarray(y, dtype="float64")
+    weights = weights.tocsr()
+    n = len(y)
+    selfWeights = weights.diagonal()
+    others = weights.copy()
+    others.setdiag(0)
+    others.eliminate_zeros()
+    observed = weights @ y
+
+    # Cells with the same number of neighbours are processed together.
+    counts = np.diff(others.indptr)
+    chunks = []
+    for k in np.unique(counts):
+        cells = np.flatnonzero(counts == k)
+        for start in range(0, len(cells), chunkSize):
+            chunks.append(cells[start : start + chunkSize])
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+
+    def arguments(cells, chunkSeed):
+        neighbourWeights = np.array(
+            [others.data[others.indptr[c] : others.indptr[c + 1]] for c in cells]
+        ).reshape(len(cells), -1)
+        return (
+            y,
+            cells,
+            observed[cells],
+            selfWeights[cells],
+            neighbourWeights,
+            permutations,
+            chunkSeed,
+        )
+
+    larger = np.zeros(n, dtype="int64")
+    jobs = jobs or os.cpu_count()
+    if jobs == 1:
+        for cells, chunkSeed in zip(chunks, seeds):
+            larger[cells] = _permuteChunk(*arguments(cells, chunkSeed))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                (cells, executor.submit(_permuteChunk, *arguments(cells, chunkSeed)))
+                for cells, chunkSeed in zip(chunks, seeds)
+            ]
+            for cells, future in futures:
+                larger[cells] = future.result()
+
+    return (larger + 1) / (permutations + 1)
+
+
+def correct(p, correction="none"):
+    """
+    Adjust p-values for testing many cells at once.
+
+    @param p: A C{np.ndarray} of p-values, 1D or 2D with one column per
+        variable, which are corrected separately. NaN values are ignored.
+    @param correction: The C{str} correction: 'none', 'bonferroni' or 'fdr'
+        (the Benjamini-Hochberg false discovery rate).
+    @raise ValueError: If the correction is unknown.
+    @return: A C{np.ndarray} of adjusted p-values.
+    """
+    if correction not in CORRECTIONS:
+        raise ValueError(
+            f"Unknown correction {correction!r}. Use one of "
+            f"{', '.join(CORRECTIONS)}."
+        )
+
+    p = np.asarray(p, dtype="float64")
+    if correction == "none":
+        return p.copy()
+    if p.ndim == 2:
+        return np.column_stack([correct(column, correction) for column in p.T])
+
+    adjusted = np.full(p.shape, np.nan)
+    valid = ~np.isnan(p)
+    values = p[valid]
+    m = len(values)
+
+    if correction == "bonferroni":
+        adjusted[valid] = np.minimum(values * m, 1)
+    else:
+        order = np.argsort(values)
+        scaled = values[order] * m / np.arange(1, m + 1)
+        # Make the adjusted p-values monotonic, from the largest down.
+        scaled = np.minimum.accumulate(scaled[::-1])[::-1]
+        result = np.empty(m)
+        result[order] = np.minimum(scaled, 1)
+        adjusted[valid] = result
+
+    return adjusted
+
+
+def classify(z, p, alpha=0.05, correction="none"):
+    """
+    Classify cells as hot spots, cold spots or not significant.
+
+    @param z: A C{np.ndarray} of z-scores.
+    @param p: A C{np.ndarray} of p-values.
+    @param alpha: The C{float} significance level.
+    @param correction: The C{str} correction of the p-values, see C{correct}.
+    @return: A C{np.ndarray} of C{HOT}, C{COLD} and C{NOTSIGNIFICANT}. Cells
+        with a NaN z-score or p-value are not significant.
+    """
+    significant = correct(p, correction) <= alpha
+    return np.where(significant, np.where(z > 0, HOT, COLD), NOTSIGNIFICANT).astype(
+        object
+    )
+
+
+def hotspots(
+    y,
+    weights,
+    alpha=0.05,
+    correction="none",
+    permutations=0,
+    seed=12345,
+    jobs=1,
+):
+    """
+    Compute Gi* z-scores and p-values and classify the cells.
+
+    @param y: A C{np.ndarray} with the value of each cell, either 1D or 2D
+        with one column per variable, with NaN for missing values.
+    @param weights: A C{scipy.sparse} matrix of shape (n, n) with the weights
+        between the cells, including the self weights.
+    @param alpha: The C{float} significance level.
+    @param correction: The C{str} correction of the p-values, see C{correct}.
+        Each variable is corrected separately.
+    @param permutations: The C{int} number of permutations for pseudo
+        p-values, or 0 to use analytic p-values. Permutations are run for
+        one variable after the other.
+    @param seed: The C{int} seed of the permutations.
+    @param jobs: The C{int} number of processes for the permutations. Use 0
+        for one per CPU.
+    @return: A C{tuple} of C{np.ndarray}s of the shape of C{y} with the
+        z-scores, the (unadjusted) p-values and the classes.
+    """
+    y = np.asarray(y, dtype="float64")
+    z = giStar(y, weights)
+    if permutations:
+        columns = y.reshape(len(y), -1)
+        weights = weights.tocsr()
+        p = np.full(columns.shape, np.nan)
+        for i, column in enumerate(columns.T):
+            # Leave out the cells without values of this variable.
+            present = np.flatnonzero(~np.isnan(column))
+            p[present, i] = permutationPValues(
+                column[present],
+                weights[present][:, present],
+                permutations,
+                seed,
+                jobs,
+            )
+        p = p.reshape(y.shape)
+        p[np.isnan(z)] = np.nan
+    else:
+        p = analyticPValues(z)
+
+    return z, p, classify(z, p, alpha, correction)
@@ -0,0 +1,168 @@
+import numpy as np
+
+from giscode.common import NODATAVAL
+from giscode.qa import lookupTable, validMask
+
+# Optional backends for the fused surface temperature kernel.
+try:
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# Scale factor and offset of the Landsat Collection 2 Level 2 surface
+# temperature band, see https://www.usgs.gov/faqs/how-do-i-use-a-scale-factor-
+# landsat-level-2-science-products
+SCALE = 0.00341802
+OFFSET = 149.0
+KELVIN = 273.15
+
+# Fill values of the surface temperature and the QA_PIXEL bands.
+B10FILL = 0
+QAFILL = 1
+
+
+def toCelsius(b10Data):
+    """
+    Re-scale surface temperature digital numbers and convert them to Celsius.
+    Fill pixels are set to NODATAVAL.
+
+    @param b10Data: A C{np.ndarray} with the digital numbers of a Landsat 8 or
+        9 surface temperature (B10) band.
+    @return: A C{np.ndarray} of C{float64} with the temperature in Celsius.
+    """
+    # Do the arithmetic in place on a single float64 copy.
+    celsius = b10Data.astype("float64")
+    celsius *= SCALE
+    celsius += OFFSET - KELVIN
+    celsius[b10Data == B10FILL] = NODATAVAL
+    return celsius
+
+
+def maskClouds(tempData, qaData, policy="strict"):
+    """
+    Set all pixels that are not usable according to the QA_PIXEL band to
+    NODATAVAL, in place.
+
+    @param tempData: A C{np.ndarray} with the surface temperature.
+    @param qaData: A C{np.ndarray} with the QA_PIXEL band on the same grid.
+    @param policy: The mask policy, see C{giscode.qa}.
+    @return: C{tempData}.
+    """
+    tempData[~validMask(qaData, policy)] = NODATAVAL
+    return tempData
+
+
+def _numpyKernel(b10Data, qaData, lut, out):
+    np.multiply(b10Data, SCALE, out=out, casting="same_kind")
+    out += OFFSET - KELVIN
+    out[~lut[qaData] | (b10Data == B10FILL)] = NODATAVAL
+
+
+def _numexprKernel(b10Data, qaData, lut, out):
+    # numexpr can't index, so the lookup is done beforehand.
+    numexpr.evaluate(
+        "where(valid & (b10 != fill), b10 * scale + shift, nodata)",
+        local_dict={
+            "b10": b10Data,
+            "valid": lut[qaData],
+            "fill": B10FILL,
+            "scale": SCALE,
+            "shift": OFFSET - KELVIN,
+            "nodata": NODATAVAL,
+        },
+        out=out,
+        casting="unsafe",
+    )
+
+
+if numba is not None:
+
+    @numba.njit(parallel=True, cache=True)
+    def _numbaLoop(b10Data, qaData, lut, out):
+        for i in numba.prange(b10Data.size):
+            if lut[qaData[i]] and b10Data[i] != B10FILL:
+                out[i] = b10Data[i] * SCALE + (OFFSET - KELVIN)
+            else:
+                out[i] = NODATAVAL
+
+    def _numbaKernel(b10Data, qaData, lut, out):
+        _numbaLoop(b10Data.ravel(), qaData.ravel(), lut, out.reshape(-1))
+
+else:
+    _numbaKernel = None
+
+
+KERNELS = {
+    "numpy": _numpyKernel,
+    "numexpr": _numexprKernel if numexpr is not None else None,
+    "numba": _numbaKernel,
+}
+
+
+def limitThreads(threads=1):
+    """
+    Limit the number of threads the numba backend uses in this process, e.g.
+    in the workers of a process pool, so that N workers use N threads rather
+    than N times the number of CPUs.
+
+    @param threads: The C{int} maximum number of threads.
+    """
+    if numba is not None:
+        numba.set_num_threads(threads)
+
+
+def availableBackends():
+    """
+    Get the backends of C{surfaceTemperature} that can be used.
+
+    @return: A C{list} of C{str} backend names, fastest first.
+    """
+    return [name for name in ("numba", "numexpr", "numpy") if KERNELS[name]]
+
+
+def surfaceTemperature(
+    b10Data, qaData, out=None, dtype="float64", backend="auto", policy="strict"
+):
+    """
+    Compute the cloud masked surface temperature in Celsius directly from the
+    raw digital numbers in a single pass. This fuses re-scaling, the Kelvin to
+    Celsius conversion and the cloud and fill masking, so no intermediate
+    float arrays are created.
+
+    @param b10Data: A C{np.ndarray} with the digital numbers of a Landsat 8 or
+        9 surface temperature (B10) band.
+    @param qaData: A C{np.ndarray} with the QA_PIXEL band on the same grid.
+    @param out: A C-contiguous C{np.ndarray} with the same shape as
+        C{b10Data} to write the result to, or C{None} to allocate one.
+    @param dtype: The C{str} dtype of the result if C{out} is C{None}.
+    @param backend: The C{str} name of the backend to use (one of 'numba',
+        'numexpr' or 'numpy'), or 'auto' to use the fastest available one.
+    @param policy: The mask policy that decides which pixels are usable, see
+        C{giscode.qa}.
+    @raise ValueError: If the backend is unknown or not installed.
+    @return: A C{np.ndarray} with the temperature in Celsius. Pixels that are
+        not usable or have no data are set to NODATAVAL.
+    """
+    if backend == "auto":
+        backend = availableBackends()[0]
+
+    kernel = KERNELS.get(backend)
+    if kernel is None:
+        raise ValueError(
+            f"Unknown or unavailable backend {backend!r}. Available backends: "
+            f"{', '.join(availableBackends())}."
+        )
+
+    b10Data = np.ascontiguousarray(b10Data)
+    qaData = np.ascontiguousarray(qaData)
+    if out is None:
+        out = np.empty(b10Data.shape, dtype=dtype)
+
+    kernel(b10Data, qaData, lookupTable(policy), out)
+
+    return out
@@ -0,0 +1,119 @@
+"""
+A build manifest that records content hashes of the inputs and the parameters
+each output was made from, so that reruns only rebuild outputs whose inputs or
+parameters changed.
+"""
+
+import hashlib
+import json
+import os
+from os.path import exists, splitext
+
+MANIFEST = "manifest.json"
+
+# Files that make up a shapefile. A change in any of them changes the cutline.
+SHAPEFILE_EXTENSIONS = (".shp", ".shx", ".dbf", ".prj")
+
+
+def readManifest(filename):
+    """
+    Read a build manifest.
+
+    @param filename: The C{str} filename of the manifest.
+    @return: A C{dict} with a 'hashes' C{dict} (the hash cache, see
+        C{fileHash}) and an 'outputs' C{dict} mapping output names to the
+        inputs and parameters they were built from. Both are empty if the
+        manifest does not exist.
+    """
+    if exists(filename):
+        with open(filename) as fp:
+            return json.load(fp)
+
+    return {"hashes": {}, "outputs": {}}
+
+
+def writeManifest(filename, manifest):
+    """
+    Write a build manifest. The manifest is written to a temporary file first
+    so that an interrupted run can't leave a truncated manifest behind.
+
+    @param filename: The C{str} filename of the manifest.
+    @param manifest: A C{dict} as returned by C{readManifest}.
+    """
+    tmp = filename + ".tmp"
+    with open(tmp, "w") as fp:
+        json.dump(manifest, fp, indent=1, sort_keys=True)
+    os.replace(tmp, filename)
+
+
+def fileHash(filename, cache=None):
+    """
+    Compute the SHA-256 hash of a file's content.
+
+    @param filename: The C{str} name of the file.
+    @param cache: A C{dict} mapping filenames to their size, modification time
+        and hash, or C{None}. If the size and modification time of the file
+        are unchanged, the cached hash is returned without reading the file.
+        New hashes are added to the cache.
+    @return: The C{str} hex digest of the file's content.
+    """
+    stat = os.stat(filename)
+    if cache is not None:
+        cached = cache.get(filename)
+        if (
+            cached
+            and cached["size"] == stat.st_size
+            and cached["mtime"] == stat.st_mtime_ns
+        ):
+            return cached["sha256"]
+
+    digest = hashlib.sha256()
+    with open(filename, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(chunk)
+    sha256 = digest.hexdigest()
+
+    if cache is not None:
+        cache[filename] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "sha256": sha256,
+        }
+
+    return sha256
+
+
+def shapefileHash(filename, cache=None):
+    """
+    Compute a hash over all files that make up a shapefile.
+
+    @param filename: The C{str} name of the *.shp file.
+    @param cache: A C{dict} hash cache, see C{fileHash}.
+    @return: The C{str} hex digest.
+    """
+    base = splitext(filename)[0]
+    digest = hashlib.sha256()
+    for extension in SHAPEFILE_EXTENSIONS:
+        if exists(base + extension):
+            digest.update(extension.encode())
+            digest.update(fileHash(base + extension, cache).encode())
+
+    return digest.hexdigest()
+
+
+def isUpToDate(manifest, name, record, outFile):
+    """
+    Check whether an output needs to be rebuilt.
+
+    @param manifest: A C{dict} as returned by C{readManifest}.
+    @param name: The C{str} name of the output in the manifest.
+    @param record: A C{dict} describing the current inputs and parameters of
+        the output. Must be JSON serialisable.
+    @param outFile: The C{str} filename of the output.
+    @return: C{True} if the output exists and was built from exactly the same
+        inputs and parameters.
+    """
+    # Round-trip through JSON so that e.g. tuples compare equal to the lists
+    # they were stored as.
+    record = json.loads(json.dumps(record))
+    return exists(outFile) and manifest["outputs"].get(name) == record
@@ -0,0 +1,390 @@
+"""
+Preprocess Landsat scenes in a single process. Each scene is reprojected,
+re-scaled, clipped, cloud masked and resampled to the 100x100m grid in memory,
+and only the final raster is written to disk. This does the same as the
+'reproject', 'rescale', 'clip', 'mask-clouds' and 'resolution' steps in the
+Makefile. A build manifest makes sure that only scenes whose inputs or
+parameters changed are rebuilt.
+"""
+
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from os import cpu_count
+from os.path import basename, isdir, join, normpath
+from time import time
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.mask import mask
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import reproject
+
+from giscode.common import (
+    CRS,
+    CUTLINE,
+    GRIDBOUNDS,
+    GRIDRES,
+    LANDSATDIR,
+    NODATAVAL,
+    PROCLSDIR,
+)
+from giscode.landsat import (
+    B10FILL,
+    OFFSET,
+    QAFILL,
+    SCALE,
+    limitThreads,
+    surfaceTemperature,
+)
+from giscode.manifest import (
+    MANIFEST,
+    fileHash,
+    isUpToDate,
+    readManifest,
+    shapefileHash,
+    writeManifest,
+)
+from giscode.qa import getPolicy
+from giscode.raster import writeRaster
+
+
+def findScenes(landsatDir=LANDSATDIR):
+    """
+    Find the downloaded Landsat scenes.
+
+    @param landsatDir: The C{str} directory containing one directory per
+        scene, named after the scene (e.g. LC08_L2SP_194027_20220623_...).
+    @return: A sorted C{list} of C{str} scene directories.
+    """
+    return sorted(d for d in glob(join(landsatDir, "LC*")) if isdir(d))
+
+
+def sceneName(sceneDir):
+    """
+    Get the name of a scene from its directory.
+
+    @param sceneDir: The C{str} directory of the scene.
+    @return: The C{str} name of the scene.
+    """
+    return basename(normpath(sceneDir))
+
+
+def outputPath(sceneDir, outDir=PROCLSDIR):
+    """
+    Get the name of the final raster of a scene.
+
+    @param sceneDir: The C{str} directory of the scene.
+    @param outDir: The C{str} directory the final raster is written to.
+    @return: The C{str} filename of the final raster.
+    """
+    return join(outDir, sceneName(sceneDir) + "_ST_B10-resolution.TIF")
+
+
+def readCutline(cutline=CUTLINE):
+    """
+    Read the polygons that the scenes are clipped to.
+
+    @param cutline: The C{str} filename of the shapefile with the polygons.
+    @return: A C{list} of shapely geometries in the target CRS.
+    """
+    return list(gpd.read_file(cutline).to_crs(CRS).geometry)
+
+
+def gridTransform():
+    """
+    Get the transform and shape of the 100x100m grid.
+
+    @return: A C{tuple} of the C{Affine} transform and the C{(height, width)}
+        shape of the grid.
+    """
+    west, south, east, north = GRIDBOUNDS
+    shape = (round((north - south) / GRIDRES), round((east - west) / GRIDRES))
+    return from_origin(west, north, GRIDRES, GRIDRES), shape
+
+
+def warpAndClip(filename, shapes, fill):
+    """
+    Reproject a band to the target CRS and clip it to the cutline, without
+    writing intermediate files.
+
+    @param filename: The C{str} name of the single band input file.
+    @param shapes: A C{list} of geometries to clip to.
+    @param fill: The value used for pixels outside the scene or the cutline.
+    @return: A C{tuple} of the clipped C{np.ndarray} and its C{Affine}
+        transform.
+    """
+    with rasterio.open(filename) as src:
+        with WarpedVRT(src, crs=CRS, resampling=Resampling.nearest, nodata=fill) as vrt:
+            data, transform = mask(vrt, shapes, crop=True, nodata=fill)
+
+    return data[0], transform
+
+
+def processScene(
+    sceneDir, outRaster, shapes=None, policy="strict", storage="float64", cog=False
+):
+    """
+    Run all preprocessing steps for one scene and write the final raster.
+
+    @param sceneDir: The C{str} directory of the scene. Must contain the
+        *_ST_B10.TIF and *_QA_PIXEL.TIF files of a Landsat 8 or 9 Collection 2
+        Level 2 product.
+    @param outRaster: The C{str} filename that the final raster will be
+        written to.
+    @param shapes: A C{list} of geometries to clip to, as returned by
+        C{readCutline}. If C{None}, the cutline is read from disk.
+    @param policy: The mask policy that decides which pixels are usable, see
+        C{giscode.qa}.
+    @param storage: The C{str} storage profile of the final raster, see
+        C{giscode.raster}.
+    @param cog: If C{True}, write the final raster as a Cloud-Optimized
+        GeoTIFF with overviews.
+    """
+    if shapes is None:
+        shapes = readCutline()
+
+    name = join(sceneDir, sceneName(sceneDir))
+
+    # Reproject and clip. Both bands have the same source grid, so they are
+    # aligned after warping.
+    b10Data, transform = warpAndClip(name + "_ST_B10.TIF", shapes, B10FILL)
+    qaData, _ = warpAndClip(name + "_QA_PIXEL.TIF", shapes, QAFILL)
+
+    # Re-scale, convert to Celsius and mask everything that is not usable.
+    celsius = surfaceTemperature(b10Data, qaData, policy=policy)
+
+    # Change the resolution from 30x30 to 100x100m.
+    dstTransform, shape = gridTransform()
+    resampled = np.full(shape, NODATAVAL, dtype="float64")
+    reproject(
+        source=celsius,
+        destination=resampled,
+        src_transform=transform,
+        src_crs=CRS,
+        src_nodata=NODATAVAL,
+        dst_transform=dstTransform,
+        dst_crs=CRS,
+        dst_nodata=NODATAVAL,
+        resampling=Resampling.nearest,
+    )
+
+    writeRaster(outRaster, [resampled], CRS, dstTransform, storage, cog=cog)
+
+
+def runScene(sceneDir, outDir, shapes, policy="strict", storage="float64", cog=False):
+    """
+    Preprocess one scene, catching any error so that the other scenes can
+    still be processed.
+
+    @param sceneDir: The C{str} directory of the scene.
+    @param outDir: The C{str} directory the final raster is written to.
+    @param shapes: A C{list} of geometries to clip to.
+    @param policy: The mask policy, see C{giscode.qa}.
+    @param storage: The C{str} storage profile, see C{giscode.raster}.
+    @param cog: If C{True}, write a Cloud-Optimized GeoTIFF.
+    @return: A C{dict} with the scene name, the output filename, the C{str}
+        status ('ok' or 'failed'), the error message (or C{None}) and the
+        number of seconds it took.
+    """
+    start = time()
+    outRaster = outputPath(sceneDir, outDir)
+    try:
+        processScene(sceneDir, outRaster, shapes, policy, storage, cog)
+    except Exception as e:
+        status, error = "failed", f"{e.__class__.__name__}: {e}"
+    else:
+        status, error = "ok", None
+
+    return {
+        "scene": sceneName(sceneDir),
+        "outRaster": outRaster,
+        "status": status,
+        "error": error,
+        "seconds": time() - start,
+    }
+
+
+def pipelineParams(policy="strict", storage="float64", cog=False):
+    """
+    Get the parameters that the final rasters depend on. Changing any of them
+    invalidates all previously built rasters.
+
+    @param policy: The mask policy, see C{giscode.qa}.
+    @param storage: The C{str} storage profile, see C{giscode.raster}.
+    @param cog: C{True} if the rasters are Cloud-Optimized GeoTIFFs.
+    @return: A C{dict} of parameters.
+    """
+    return {
+        "crs": CRS,
+        "gridBounds": GRIDBOUNDS,
+        "gridRes": GRIDRES,
+        "nodata": NODATAVAL,
+        "scale": SCALE,
+        "offset": OFFSET,
+        "policy": getPolicy(policy)._asdict(),
+        "storage": storage,
+        "cog": cog,
+    }
+
+
+def sceneRecord(sceneDir, cutlineHash, params, cache):
+    """
+    Describe the inputs and parameters that the final raster of a scene is
+    built from.
+
+    @param sceneDir: The C{str} directory of the scene.
+    @param cutlineHash: The C{str} hash of the cutline shapefile.
+    @param params: A C{dict} as returned by C{pipelineParams}.
+    @param cache: A C{dict} hash cache, see C{giscode.manifest.fileHash}.
+    @return: A C{dict} for the build manifest.
+    """
+    name = join(sceneDir, sceneName(sceneDir))
+    return {
+        "b10": fileHash(name + "_ST_B10.TIF", cache),
+        "qa": fileHash(name + "_QA_PIXEL.TIF", cache),
+        "cutline": cutlineHash,
+        "params": params,
+    }
+
+
+def processScenes(
+    sceneDirs,
+    outDir=PROCLSDIR,
+    cutline=CUTLINE,
+    jobs=1,
+    force=False,
+    policy="strict",
+    storage="float64",
+    cog=False,
+    verbose=False,
+):
+    """
+    Preprocess several scenes, reading the cutline only once. No scene depends
+    on another, so with more than one job the scenes are distributed over a
+    pool of processes.
+
+    A build manifest in C{outDir} records the content hashes of the inputs and
+    the parameters of each final raster. Scenes whose final raster exists and
+    whose inputs and parameters are unchanged are skipped.
+
+    @param sceneDirs: An iterable of C{str} scene directories.
+    @param outDir: The C{str} directory the final rasters are written to.
+    @param cutline: The C{str} filename of the shapefile to clip to.
+    @param jobs: The C{int} number of processes to use. If 0, use one process
+        per CPU. With more than one process, each one runs single-threaded.
+    @param force: If C{True}, rebuild all scenes.
+    @param policy: The mask policy, see C{giscode.qa}.
+    @param storage: The C{str} storage profile, see C{giscode.raster}.
+    @param cog: If C{True}, write Cloud-Optimized GeoTIFFs.
+    @param verbose: If C{True}, print the directory of each scene that is
+        processed.
+    @return: A C{list} of C{dict}s as returned by C{runScene}, in the order of
+        C{sceneDirs}. Skipped scenes have the status 'skipped'.
+    """
+    manifestFile = join(outDir, MANIFEST)
+    manifest = readManifest(manifestFile)
+    cache = manifest["hashes"]
+    cutlineHash = shapefileHash(cutline, cache)
+    params = pipelineParams(policy, storage, cog)
+
+    results = {}
+    records = {}
+    todo = []
+    for sceneDir in sceneDirs:
+        name = sceneName(sceneDir)
+        try:
+            records[name] = sceneRecord(sceneDir, cutlineHash, params, cache)
+        except OSError:
+            # Let runScene report the missing input.
+            todo.append(sceneDir)
+            continue
+
+        outRaster = outputPath(sceneDir, outDir)
+        if not force and isUpToDate(manifest, name, records[name], outRaster):
+            results[sceneDir] = {
+                "scene": name,
+                "outRaster": outRaster,
+                "status": "skipped",
+                "error": None,
+                "seconds": 0.0,
+            }
+        else:
+            todo.append(sceneDir)
+
+    if todo:
+        shapes = readCutline(cutline)
+        jobs = min(jobs or cpu_count(), len(todo))
+
+        if jobs == 1:
+            for sceneDir in todo:
+                if verbose:
+                    print(sceneDir)
+                results[sceneDir] = runScene(
+                    sceneDir, outDir, shapes, policy, storage, cog
+                )
+        else:
+            # Spawn the workers instead of forking them: a forked copy of a
+            # process that already used the threaded numba kernel can hang.
+            # Each worker runs the kernel on a single thread.
+            with ProcessPoolExecutor(
+                max_workers=jobs,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=limitThreads,
+                initargs=(1,),
+            ) as executor:
+                futures = {
+                    sceneDir: executor.submit(
+                        runScene, sceneDir, outDir, shapes, policy, storage, cog
+                    )
+                    for sceneDir in todo
+                }
+                for sceneDir, future in futures.items():
+                    results[sceneDir] = future.result()
+                    if verbose:
+                        print(sceneDir)
+
+    for sceneDir in todo:
+        result = results[sceneDir]
+        if result["status"] == "ok":
+            manifest["outputs"][result["scene"]] = records[result["scene"]]
+        else:
+            manifest["outputs"].pop(result["scene"], None)
+
+    writeManifest(manifestFile, manifest)
+
+    return [results[sceneDir] for sceneDir in sceneDirs]
+
+
+def printSummary(results, fp=sys.stdout):
+    """
+    Print the status and timing of each processed scene.
+
+    @param results: A C{list} of C{dict}s as returned by C{processScenes}.
+    @param fp: An open file to print to.
+    @return: The C{int} number of scenes that failed.
+    """
+    failed = skipped = 0
+    for result in results:
+        print(
+            f"{result['scene']}  {result['status']:7s} {result['seconds']:8.2f}s",
+            file=fp,
+        )
+        if result["status"] == "skipped":
+            skipped += 1
+        if result["error"]:
+            failed += 1
+            print(f"    {result['error']}", file=fp)
+
+    total = sum(result["seconds"] for result in results)
+    print(
+        f"{len(results)} scenes, {skipped} up to date, {failed} failed, "
+        f"{total:.2f}s of processing time.",
+        file=fp,
+    )
+
+    return failed
@@ -0,0 +1,300 @@
+"""
+Rasterise the hectare population statistics. Every row describes a 100x100m
+cell by the coordinates (E, N) of its centre. Missing values are NODATAVAL
+(-999) in the CSV file. The CSV file can be converted once to a typed Parquet
+file with nulls for missing values, which is much faster to read, and from
+which only the columns and cells that are needed are read.
+
+Bands are given as expressions over the columns, either a column name such
+as 'DICHTE_PHA' or 'name=expression' such as 'J_0_15_P=J_0_6_P + J_7_15_P'.
+Expressions are evaluated with C{pd.DataFrame.eval} and may use the bands
+before them. A band is missing where any value it is computed from is.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.transform import from_origin
+
+from giscode.common import NODATAVAL
+from giscode.raster import readBand
+
+# The size of a hectare cell in metres.
+CELL = 100
+
+# The columns that the number and percentage of people >65 years old are
+# computed from.
+OLDCOLUMNS = ("PERS_N", "J_65_79_P", "J_80PLUS_P")
+
+# The default bands: the percentage and number of people >65 years old and
+# the number of people.
+BANDS = ("J_65PLUS_P", "J_65PLUS_T", "PERS_N")
+
+
+def toParquet(inCsv, outParquet, rowGroupSize=2048):
+    """
+    Convert the population statistics CSV file to a Parquet file. Integer
+    columns become nullable integers and float columns nullable floats, with
+    nulls instead of NODATAVAL. The cells are sorted north to south and west
+    to east, so that the row group statistics of E and N let readers skip
+    row groups outside of a bounding box.
+
+    @param inCsv: The C{str} name of the CSV file.
+    @param outParquet: The C{str} name of the Parquet file.
+    @param rowGroupSize: The C{int} maximum number of cells per row group.
+    """
+    d = pd.read_csv(inCsv, encoding="utf-8-sig")
+    for column in d:
+        if pd.api.types.is_integer_dtype(d[column]):
+            d[column] = d[column].astype("Int64")
+        d[column] = d[column].mask(d[column] == NODATAVAL)
+
+    d.sort_values(["N", "E"], ascending=[False, True], inplace=True)
+    d.to_parquet(outParquet, index=False, row_group_size=rowGroupSize)
+
+
+def readPopulation(filename, columns=None, bbox=None):
+    """
+    Read the population statistics.
+
+    @param filename: The C{str} name of the CSV file or of a Parquet file
+        written by C{toParquet} (ending in .parquet).
+    @param columns: A C{list} of C{str} names of the columns to read, or
+        C{None} to read all of them.
+    @param bbox: A C{tuple} (west, south, east, north) of the area whose cell
+        centres to read, or C{None} to read all cells. Parquet files are
+        filtered while reading.
+    @return: A C{pd.DataFrame} with C{float64} columns and NaN for missing
+        values.
+    """
+    filters = None
+    if bbox is not None:
+        west, south, east, north = bbox
+        filters = [
+            ("E", ">=", west),
+            ("E", "<=", east),
+            ("N", ">=", south),
+            ("N", "<=", north),
+        ]
+
+    if filename.endswith(".parquet"):
+        d = pd.read_parquet(filename, columns=columns, filters=filters)
+    else:
+        d = pd.read_csv(filename, usecols=columns, encoding="utf-8-sig")
+        d = d.mask(d == NODATAVAL)
+        for column, op, value in filters or ():
+            d = d[d[column] >= value if op == ">=" else d[column] <= value]
+
+    return d.astype("float64").reset_index(drop=True)
+
+
+def tableColumns(filename):
+    """
+    Get the column names of the population statistics without reading them.
+
+    @param filename: The C{str} name of the CSV or Parquet file.
+    @return: A C{list} of C{str} column names.
+    """
+    if filename.endswith(".parquet"):
+        import pyarrow.parquet
+
+        return pyarrow.parquet.read_schema(filename).names
+
+    return list(pd.read_csv(filename, nrows=0, encoding="utf-8-sig").columns)
+
+
+def bandColumns(bands, available):
+    """
+    Find the columns that band expressions use.
+
+    @param bands: A C{list} of C{str} band expressions.
+    @param available: A C{list} of the C{str} column names of the table.
+    @return: A C{list} of C{str} column names: the cell coordinates, those
+        used in the expressions and, if the expressions use the columns added
+        by C{addOldColumns}, the ones it needs.
+    """
+    names = set()
+    for band in bands:
+        names.update(re.findall(r"[A-Za-z_]\w*", parseBand(band)[1]))
+    if names & {"J_65PLUS_P", "J_65PLUS_T"}:
+        names.update(OLDCOLUMNS)
+
+    return ["E", "N"] + [column for column in available if column in names - {"E", "N"}]
+
+
+def addOldColumns(d):
+    """
+    Add the number (J_65PLUS_T) and percentage (J_65PLUS_P) of people >65
+    years old to the population statistics, in place. Both are NODATAVAL for
+    cells without a number of people or age percentages.
+
+    @param d: A C{pd.DataFrame} of population statistics.
+    @return: C{d}.
+    """
+    people = d["PERS_N"].to_numpy(dtype="float64")
+    young = d["J_65_79_P"].to_numpy(dtype="float64")
+    old = d["J_80PLUS_P"].to_numpy(dtype="float64")
+    missing = np.isnan(people + young + old)
+    missing |= (people == NODATAVAL) | (young == NODATAVAL) | (old == NODATAVAL)
+
+    percent = young + old
+    percent[missing] = NODATAVAL
+    total = np.round(percent * people / 100)
+    total[missing] = NODATAVAL
+
+    d["J_65PLUS_T"] = total
+    d["J_65PLUS_P"] = percent
+    return d
+
+
+def hectareGrid(d, cell=CELL):
+    """
+    Find the smallest grid that contains all cells and the position of every
+    cell in it.
+
+    @param d: A C{pd.DataFrame} with the cell centres in columns E and N.
+    @param cell: The C{int} size of a cell in metres.
+    @return: A C{tuple} of the C{Affine} transform, the C{(height, width)}
+        shape of the grid and C{np.ndarray}s with the row and column of every
+        cell.
+    """
+    x = d["E"].to_numpy(dtype="float64")
+    y = d["N"].to_numpy(dtype="float64")
+    west = x.min() - cell / 2
+    north = y.max() + cell / 2
+    height = int(round((north - (y.min() - cell / 2)) / cell))
+    width = int(round((x.max() + cell / 2 - west) / cell))
+
+    rows = np.rint((north - y) / cell - 0.5).astype("intp")
+    cols = np.rint((x - west) / cell - 0.5).astype("intp")
+
+    return from_origin(west, north, cell, cell), (height, width), rows, cols
+
+
+def parseBand(band):
+    """
+    Split a band expression into its name and expression.
+
+    @param band: A C{str} column name or 'name=expression'.
+    @return: A C{tuple} of the C{str} name and expression.
+    """
+    name, sep, expression = band.partition("=")
+    if not sep:
+        expression = name
+    return name.strip(), expression.strip()
+
+
+def evaluate(frame, bands):
+    """
+    Evaluate band expressions.
+
+    @param frame: A C{pd.DataFrame} with NODATAVAL or NaN for missing values.
+    @param bands: A C{list} of C{str} band expressions.
+    @raise ValueError: If an expression can't be evaluated.
+    @return: A C{pd.DataFrame} with one C{float64} column per band, named
+        after it, with NaN for missing values.
+    """
+    frame = frame.replace(NODATAVAL, np.nan)
+    result = {}
+    for band in bands:
+        name, expression = parseBand(band)
+        try:
+            values = frame.eval(expression)
+        except Exception as e:
+            raise ValueError(f"Can't evaluate band {band!r}: {e}") from e
+        values = np.array(
+            np.broadcast_to(np.asarray(values, dtype="float64"), len(frame))
+        )
+        # Division by zero etc. give missing values too.
+        values[~np.isfinite(values)] = np.nan
+        # Later bands can use this one.
+        frame[name] = result[name] = values
+
+    return pd.DataFrame(result, index=frame.index)
+
+
+def bandScales(bands):
+    """
+    Choose the scales of bands for integer storage profiles: 1 for bands
+    that only have whole numbers (e.g. numbers of people) and 0.01 for the
+    others (e.g. percentages).
+
+    @param bands: A C{list} of C{np.ndarray}s with NaN or NODATAVAL for
+        missing data.
+    @return: A C{list} of C{float} scales.
+    """
+    scales = []
+    for band in bands:
+        values = band[~np.isnan(band) & (band != NODATAVAL)]
+        scales.append(1 if np.all(values == np.round(values)) else 0.01)
+    return scales
+
+
+def rasterise(d, bands=BANDS, cell=CELL):
+    """
+    Rasterise the population statistics. All bands are evaluated in one pass
+    over the table and each band is filled with a single scatter of all
+    cells.
+
+    @param d: A C{pd.DataFrame} of population statistics.
+    @param bands: A C{list} of C{str} band expressions.
+    @param cell: The C{int} size of a cell in metres.
+    @raise ValueError: If an expression can't be evaluated.
+    @return: A C{tuple} of a C{dict} mapping band names to C{float64}
+        C{np.ndarray}s with NODATAVAL for missing data, and the C{Affine}
+        transform.
+    """
+    transform, shape, rows, cols = hectareGrid(d, cell)
+
+    result = {}
+    for name, values in evaluate(d, bands).items():
+        band = np.full(shape, NODATAVAL, dtype="float64")
+        band[rows, cols] = values.to_numpy()
+        band[np.isnan(band)] = NODATAVAL
+        result[name] = band
+
+    return result, transform
+
+
+def readBands(inRaster):
+    """
+    Read all bands of a population raster, named by their descriptions.
+
+    @param inRaster: The C{str} filename of the raster.
+    @return: A C{tuple} of a C{dict} mapping band names to C{float64}
+        C{np.ndarray}s with NODATAVAL for missing data, the CRS and the
+        C{Affine} transform. Bands without a description are named 'band1',
+        'band2', etc.
+    """
+    with rasterio.open(inRaster) as src:
+        bands = {
+            description or f"band{i}": readBand(src, i)
+            for i, description in enumerate(src.descriptions, start=1)
+        }
+        return bands, src.crs, src.transform
+
+
+def derive(bands, expressions):
+    """
+    Compute new bands from rasterised bands, without going back to the CSV.
+
+    @param bands: A C{dict} mapping band names to C{np.ndarray}s of the same
+        shape, with NODATAVAL for missing data, as returned by C{readBands}.
+    @param expressions: A C{list} of C{str} band expressions over the band
+        names.
+    @raise ValueError: If an expression can't be evaluated.
+    @return: A C{dict} mapping the names of the new bands to C{float64}
+        C{np.ndarray}s with NODATAVAL for missing data.
+    """
+    shape = next(iter(bands.values())).shape
+    frame = pd.DataFrame({name: band.ravel() for name, band in bands.items()})
+
+    result = {}
+    for name, values in evaluate(frame, expressions).items():
+        band = np.array(values, dtype="float64").reshape(shape)
+        band[np.isnan(band)] = NODATAVAL
+        result[name] = band
+
+    return result
@@ -0,0 +1,156 @@
+"""
+Decode the bit fields of the Landsat 8 and 9 Collection 2 QA_PIXEL band and
+turn them into masks of usable pixels. See the Landsat 8-9 Collection 2
+Level 2 Science Product Guide for the meaning of the bits.
+
+Whether a pixel is usable depends on a mask policy. For every policy, a
+lookup table with one entry per possible QA_PIXEL value is built once, so
+masking a band is a single gather: C{lookupTable(policy)[qaData]}.
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+# Single bit flags and their bit positions.
+FLAGS = {
+    "fill": 0,
+    "dilatedCloud": 1,
+    "cirrus": 2,
+    "cloud": 3,
+    "cloudShadow": 4,
+    "snow": 5,
+    "clear": 6,
+    "water": 7,
+}
+
+# Two bit confidence levels and the position of their lowest bit.
+CONFIDENCES = {
+    "cloud": 8,
+    "cloudShadow": 10,
+    "snow": 12,
+    "cirrus": 14,
+}
+
+# Confidence levels.
+NONE, LOW, MEDIUM, HIGH = range(4)
+
+# A mask policy. A pixel is usable if none of the C{reject} flags and all of
+# the C{require} flags are set, and none of the confidences exceeds the level
+# given in C{maxConfidence}, a C{tuple} of (name, level) pairs. If C{values}
+# is not C{None}, only the QA_PIXEL values it contains are usable and the
+# other fields are ignored.
+MaskPolicy = namedtuple(
+    "MaskPolicy",
+    ("reject", "require", "maxConfidence", "values"),
+    defaults=((), (), (), None),
+)
+
+POLICIES = {
+    # Only pixels marked as 'Clear' with low confidence for clouds, cloud
+    # shadow, snow and cirrus (21824). This is the most conservative choice.
+    "strict": MaskPolicy(values=(21824,)),
+    # Pixels marked as 'Clear' without fill, cloud, dilated cloud, cirrus,
+    # cloud shadow or snow flags, over land and water, with at most medium
+    # cloud confidence.
+    "clear": MaskPolicy(
+        reject=("fill", "dilatedCloud", "cirrus", "cloud", "cloudShadow", "snow"),
+        require=("clear",),
+        maxConfidence=(("cloud", MEDIUM),),
+    ),
+    # Like 'clear', but over land only.
+    "land": MaskPolicy(
+        reject=(
+            "fill",
+            "dilatedCloud",
+            "cirrus",
+            "cloud",
+            "cloudShadow",
+            "snow",
+            "water",
+        ),
+        require=("clear",),
+        maxConfidence=(("cloud", MEDIUM),),
+    ),
+}
+
+
+def decode(qaData):
+    """
+    Decode the bit fields of a QA_PIXEL band.
+
+    @param qaData: A C{np.ndarray} of C{uint16} QA_PIXEL values.
+    @return: A C{dict} mapping each name in C{FLAGS} to a C{bool} array and
+        each name in C{CONFIDENCES} followed by 'Confidence' (e.g.
+        'cloudConfidence') to a C{uint8} array of confidence levels.
+    """
+    qaData = np.asarray(qaData, dtype="uint16")
+    fields = {name: (qaData >> bit) & 1 == 1 for name, bit in FLAGS.items()}
+    for name, bit in CONFIDENCES.items():
+        fields[name + "Confidence"] = ((qaData >> bit) & 3).astype("uint8")
+
+    return fields
+
+
+def getPolicy(policy):
+    """
+    Look up a mask policy.
+
+    @param policy: A C{str} name from C{POLICIES} or a C{MaskPolicy}.
+    @raise ValueError: If the policy name is unknown.
+    @return: A C{MaskPolicy}.
+    """
+    if isinstance(policy, MaskPolicy):
+        return policy
+
+    try:
+        return POLICIES[policy]
+    except KeyError:
+        raise ValueError(
+            f"Unknown mask policy {policy!r}. Known policies: "
+            f"{', '.join(POLICIES)}."
+        ) from None
+
+
+@lru_cache(maxsize=None)
+def _lookupTable(policy):
+    allValues = np.arange(1 << 16, dtype="uint32")
+
+    if policy.values is not None:
+        lut = np.isin(allValues, policy.values)
+    else:
+        fields = decode(allValues)
+        lut = np.ones(allValues.shape, dtype=bool)
+        for name in policy.reject:
+            lut &= ~fields[name]
+        for name in policy.require:
+            lut &= fields[name]
+        for name, level in policy.maxConfidence:
+            lut &= fields[name + "Confidence"] <= level
+
+    lut.flags.writeable = False
+    return lut
+
+
+def lookupTable(policy="strict"):
+    """
+    Get the lookup table of a mask policy. Tables are built once per policy
+    and cached.
+
+    @param policy: A C{str} name from C{POLICIES} or a C{MaskPolicy}.
+    @return: A read-only C{np.ndarray} of 65536 C{bool}s that is C{True} at
+        the QA_PIXEL values of usable pixels.
+    """
+    return _lookupTable(getPolicy(policy))
+
+
+def validMask(qaData, policy="strict"):
+    """
+    Find the usable pixels of a QA_PIXEL band.
+
+    @param qaData: A C{np.ndarray} of C{uint16} QA_PIXEL values.
+    @param policy: A C{str} name from C{POLICIES} or a C{MaskPolicy}.
+    @return: A C{np.ndarray} of C{bool} that is C{True} for usable pixels.
+    """
+    return lookupTable(policy)[qaData]
@@ -0,0 +1,327 @@
+import os
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.io import MemoryFile
+
+from giscode.common import NODATAVAL
+
+TILED = {"tiled": True, "blockxsize": 256, "blockysize": 256}
+
+# Storage profiles for rasters. Values are always handled as float64 arrays
+# with NODATAVAL for missing data in memory, and encoded when written. Integer
+# profiles store round(value / scale) and record the scale in the raster, so
+# readers that use C{readBand} get the original values back (to within the
+# scale). 'float64' is the uncompressed legacy format.
+STORAGE = {
+    "float64": {"dtype": "float64", "nodata": NODATAVAL, "scale": 1, "options": {}},
+    "float32": {
+        "dtype": "float32",
+        "nodata": NODATAVAL,
+        "scale": 1,
+        "options": dict(TILED, compress="deflate", predictor=3),
+    },
+    # Temperatures in hundredths of a degree.
+    "int16": {
+        "dtype": "int16",
+        "nodata": np.iinfo("int16").min,
+        "scale": 0.01,
+        "options": dict(TILED, compress="zstd", predictor=2),
+    },
+    # Counts, e.g. of people. Fractional bands need a scale < 1.
+    "uint16": {
+        "dtype": "uint16",
+        "nodata": np.iinfo("uint16").max,
+        "scale": 1,
+        "options": dict(TILED, compress="zstd", predictor=2),
+    },
+}
+
+
+def getStorage(storage):
+    """
+    Look up a storage profile.
+
+    @param storage: A C{str} name from C{STORAGE}.
+    @raise ValueError: If the storage profile is unknown.
+    @return: A C{dict} describing the storage profile.
+    """
+    try:
+        return STORAGE[storage]
+    except KeyError:
+        raise ValueError(
+            f"Unknown storage profile {storage!r}. Known profiles: "
+            f"{', '.join(STORAGE)}."
+        ) from None
+
+
+def isInteger(storage):
+    """
+    Check whether a storage profile stores integers.
+
+    @param storage: A C{str} name from C{STORAGE}.
+    @return: C{True} if values are stored as (scaled) integers.
+    """
+    return np.issubdtype(getStorage(storage)["dtype"], np.integer)
+
+
+def storageKwargs(storage):
+    """
+    Get the creation options of a storage profile.
+
+    @param storage: A C{str} name from C{STORAGE}.
+    @return: A C{dict} of creation options for C{rasterio.open}.
+    """
+    profile = getStorage(storage)
+    return dict(profile["options"], dtype=profile["dtype"], nodata=profile["nodata"])
+
+
+def encode(data, storage, scale=None):
+    """
+    Encode values for writing with a storage profile.
+
+    @param data: A C{np.ndarray} of values, with NODATAVAL or NaN for missing
+        data.
+    @param storage: A C{str} name from C{STORAGE}.
+    @param scale: The C{float} scale of integer profiles, or C{None} to use
+        the default scale of the profile.
+    @return: A C{np.ndarray} of the dtype of the profile.
+    """
+    profile = getStorage(storage)
+    data = np.asarray(data, dtype="float64")
+    missing = np.isnan(data) | (data == NODATAVAL)
+
+    if not isInteger(storage):
+        encoded = data.astype(profile["dtype"])
+    else:
+        info = np.iinfo(profile["dtype"])
+        # Keep the no-data value out of the range of valid values.
+        low = info.min + 1 if profile["nodata"] == info.min else info.min
+        high = info.max - 1 if profile["nodata"] == info.max else info.max
+        encoded = np.rint(data / (scale or profile["scale"]))
+        np.clip(encoded, low, high, out=encoded)
+        encoded[missing] = 0
+        encoded = encoded.astype(profile["dtype"])
+
+    encoded[missing] = profile["nodata"]
+    return encoded
+
+
+def readBand(src, band=1, window=None):
+    """
+    Read a band and decode it, whatever storage profile it was written with.
+
+    @param src: An open rasterio dataset.
+    @param band: The C{int} band number.
+    @param window: A C{Window} to read, or C{None} to read the whole band.
+    @return: A C{np.ndarray} of C{float64} with NODATAVAL for missing data.
+    """
+    data = src.read(band, window=window)
+    decoded = data.astype("float64")
+
+    scale, offset = src.scales[band - 1], src.offsets[band - 1]
+    if scale != 1 or offset != 0:
+        decoded *= scale
+        decoded += offset
+
+    if src.nodata is not None:
+        decoded[data == src.nodata] = NODATAVAL
+    decoded[np.isnan(decoded)] = NODATAVAL
+
+    return decoded
+
+
+def findBand(src, description):
+    """
+    Find a band by its description, e.g. the name of the reducer that made it.
+
+    @param src: An open rasterio dataset.
+    @param description: The C{str} description of the band.
+    @raise ValueError: If the bands are described, but none as C{description}.
+    @return: The C{int} band number. Rasters without band descriptions, as
+        written before bands were described, have the band at number 1.
+    """
+    if not any(src.descriptions):
+        return 1
+    try:
+        return src.descriptions.index(description) + 1
+    except ValueError:
+        raise ValueError(
+            f"{src.name} has no band {description!r}. Its bands are: "
+            f"{', '.join(str(d) for d in src.descriptions)}."
+        )
+
+
+def cogOptions(storage, width, height):
+    """
+    Get the creation options for writing a Cloud-Optimized GeoTIFF with the
+    compression of a storage profile.
+
+    @param storage: A C{str} name from C{STORAGE}.
+    @param width: The C{int} width of the raster.
+    @param height: The C{int} height of the raster.
+    @return: A C{dict} of creation options for the GDAL COG driver.
+    """
+    options = getStorage(storage)["options"]
+    # Use smaller tiles for small rasters, so that they still get a few
+    # overview levels. The COG driver adds overviews until the raster fits
+    # into a single tile.
+    size = max(width, height)
+    blocksize = 256 if size > 1024 else 128 if size > 256 else 64
+
+    cog = {
+        "compress": options.get("compress", "deflate"),
+        "blocksize": blocksize,
+        "overviews": "auto",
+        "overview_resampling": "nearest",
+    }
+    if "predictor" in options:
+        cog["predictor"] = "floating_point" if options["predictor"] == 3 else "standard"
+
+    return cog
+
+
+def toCog(src, outRaster, storage):
+    """
+    Copy a raster to a Cloud-Optimized GeoTIFF with internal tiles and
+    overviews.
+
+    @param src: An open rasterio dataset or the C{str} name of a raster.
+    @param outRaster: The C{str} filename that the COG will be written to.
+    @param storage: The C{str} storage profile that C{src} was written with.
+    """
+    if isinstance(src, str):
+        with rasterio.open(src) as dataset:
+            return toCog(dataset, outRaster, storage)
+
+    rasterio.shutil.copy(
+        src, outRaster, driver="COG", **cogOptions(storage, src.width, src.height)
+    )
+
+
+def writeRaster(
+    outRaster,
+    bands,
+    crs,
+    transform,
+    storage="float64",
+    scales=None,
+    descriptions=None,
+    cog=False,
+):
+    """
+    Write bands to a GeoTIFF with a storage profile.
+
+    @param outRaster: The C{str} filename that the raster will be written to.
+    @param bands: A C{list} of 2D C{np.ndarray}s of the same shape, with
+        NODATAVAL for missing data.
+    @param crs: The CRS of the raster.
+    @param transform: The C{Affine} transform of the raster.
+    @param storage: A C{str} name from C{STORAGE}.
+    @param scales: A C{list} with the scale of each band in integer profiles.
+        C{None} entries, or C{None} for all bands, use the default scale of
+        the profile. Ignored for float profiles.
+    @param descriptions: A C{list} of C{str} band descriptions, or C{None}.
+    @param cog: If C{True}, write a Cloud-Optimized GeoTIFF with overviews.
+        The raster is first assembled in memory.
+    """
+    height, width = bands[0].shape
+    if isInteger(storage):
+        default = getStorage(storage)["scale"]
+        scales = [scale or default for scale in scales or [None] * len(bands)]
+    else:
+        scales = [1] * len(bands)
+
+    kwargs = dict(
+        driver="GTiff",
+        width=width,
+        height=height,
+        count=len(bands),
+        crs=crs,
+        transform=transform,
+        **storageKwargs(storage),
+    )
+
+    def write(dst):
+        for i, (data, scale) in enumerate(zip(bands, scales), start=1):
+            dst.write(encode(data, storage, scale), i)
+        dst.scales = scales
+        dst.offsets = [0] * len(bands)
+        if descriptions:
+            dst.descriptions = descriptions
+
+    if cog:
+        with MemoryFile() as memfile:
+            with memfile.open(**kwargs) as dst:
+                write(dst)
+            with memfile.open() as src:
+                toCog(src, outRaster, storage)
+    else:
+        with rasterio.open(fp=outRaster, mode="w", **kwargs) as dst:
+            write(dst)
+
+
+def processBlocks(
+    inRasters,
+    outRaster,
+    kwargs,
+    func,
+    storage="float64",
+    decode=(),
+    scale=None,
+    cog=False,
+):
+    """
+    Stream one or more aligned single band rasters block by block through a
+    function and write each resulting block as it goes. The blocks are those
+    of the output, e.g. the 256x256 tiles of the compact storage profiles,
+    whatever the layout of the inputs, so peak memory use is bounded by the
+    block size of the output (and GDAL's block cache), not by the raster
+    size.
+
+    @param inRasters: A C{list} of C{str} input filenames. All inputs must
+        have the same grid.
+    @param outRaster: The C{str} filename that the output will be written to.
+    @param kwargs: A C{dict} of creation options for the output raster. The
+        options of the storage profile, including its tiling, are added to
+        it.
+    @param func: A function that is called with one C{np.ndarray} block per
+        input and returns the output block, with NODATAVAL for missing data.
+    @param storage: A C{str} name from C{STORAGE} for the output.
+    @param decode: A C{list} of C{bool}s, one per input. Blocks of inputs for
+        which it is C{True} are decoded with C{readBand}, the others are
+        passed on as stored. Missing entries count as C{False}.
+    @param scale: The C{float} scale of integer storage profiles, or C{None}
+        for the default.
+    @param cog: If C{True}, convert the output to a Cloud-Optimized GeoTIFF
+        with overviews. The blocks are streamed to a temporary file next to
+        C{outRaster} first, so memory use stays bounded.
+    """
+    srcs = [rasterio.open(filename) for filename in inRasters]
+    decode = list(decode) + [False] * (len(srcs) - len(decode))
+    try:
+        kwargs = dict(kwargs, **storageKwargs(storage))
+        if isInteger(storage):
+            scale = scale or getStorage(storage)["scale"]
+        else:
+            scale = 1
+        target = outRaster + ".tmp.tif" if cog else outRaster
+        with rasterio.open(fp=target, mode="w", **kwargs) as dst:
+            # Write each block of the output once, reading the same window
+            # of the inputs.
+            for _, window in dst.block_windows(1):
+                blocks = [
+                    readBand(src, 1, window) if dec else src.read(1, window=window)
+                    for src, dec in zip(srcs, decode)
+                ]
+                dst.write(encode(func(*blocks), storage, scale), 1, window=window)
+            dst.scales = [scale]
+            dst.offsets = [0]
+
+        if cog:
+            toCog(target, outRaster, storage)
+            os.remove(target)
+    finally:
+        for src in srcs:
+            src.close()